@@ -0,0 +1,244 @@
+# The data and figures of the app as a JSON API, without streamlit:
+#   python api.py --port 8600
+# GET /api lists the endpoints and their parameters, e.g. /api/forecasts?country=Finland or /api/figures/changes_plot?year=2019.
+# Every response is cached (datacache.versioned, with the same scopes as the figures, so refresh.py updates only drop what they change)
+# and has an ETag: a request with If-None-Match gets a 304 without a body while the data has not changed.
+# The computations run on a thread pool, the event loop only answers requests.
+# world_map.py becomes a client of this API when DATA_API_URL is set, see client.py.
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import tornado.ioloop
+import tornado.web
+
+import assets
+import datacache
+from datacache import versioned
+import plots
+from util import max_year, owid_index
+from forecasts import forecast_index
+from sectors import sector_cube, CUBE_COLUMNS
+from temperature import temperature_feed
+
+PORT = int(os.environ.get("DATA_API_PORT", 8600))
+# Clients may use a response this long (seconds) before they check it again with its ETag
+MAX_AGE = 60
+# Number of responses kept in memory
+RESPONSE_CACHE_SIZE = 512
+COMPUTE_THREADS = int(os.environ.get("DATA_API_THREADS", os.cpu_count() or 4))
+# Parameters without a default
+REQUIRED = object()
+
+
+# A parameter naming something there is no data for, answered with 404
+class NotFound(Exception):
+  pass
+
+def check_country(country):
+  if country not in owid_index().country_rows:
+    raise NotFound("no country %s" % country)
+
+# parameter -> check raising NotFound, run before a response is computed, so no value is cached for a made up name
+CHECKS = {"country": check_country}
+
+
+def version_data():
+  return({"version": datacache.dataset_version(), "max_year": int(max_year()), "map_start_year": plots.MAP_START_YEAR,
+          "history_regions": plots.HISTORY_REGIONS, "history_start_year": plots.HISTORY_START_YEAR, "map_metrics": list(plots.MAP_LAYERS)})
+
+# The forecasts of a country: target, year, estimate, lci, uci
+def forecasts_data(country):
+  return(forecast_index().country(country)[["target", "year", "estimate", "lci", "uci"]])
+
+# The recorded emissions of a country of the gases of the history plot
+def history_data(country, from_year):
+  return(owid_index().country(country, from_year)[["year"] + list(plots.HISTORY_GASES)])
+
+# Values of one map metric in one year and the color bins of the year
+def map_data(metric, year):
+  if metric not in plots.MAP_LAYERS:
+    raise ValueError("unknown metric %s, one of %s" % (metric, ", ".join(plots.MAP_LAYERS)))
+  if year not in plots.map_index().year_rows:
+    raise ValueError("no map data for %d" % year)
+  bins = plots.MAP_LAYERS[metric]["bins"]
+  if bins is not None:
+    bins = [None if pd.isnull(value) else float(value) for value in plots.heatmap_bins().loc[year, metric].loc[bins]]
+  return({"metric": metric, "year": year, "bins": bins, "values": plots.map_index().year(year)[["country", "country_id", metric]]})
+
+# The data of the changes plot: a row per country in year, or in every year from year on
+def scatter_data(year, to_end):
+  return(plots.map_index().year(year, to_end=to_end)[["country", "year", "co2", "co2_growth_prct", "gdp_per_capita"]])
+
+# Sum of the sector cube values by the by columns, see sectors.SectorCube.rollup
+def sectors_data(gas, measure, entity, year, by):
+  unknown = set(by.split(",")) - set(CUBE_COLUMNS)
+  if unknown:
+    raise ValueError("unknown columns %s, by is a comma separated list of %s" % (", ".join(sorted(unknown)), ", ".join(CUBE_COLUMNS)))
+  return(sector_cube().rollup(by.split(","), gas=gas, measure=measure, entity=entity, year=year))
+
+def temperature_data():
+  return(temperature_feed(plots.TEMPERATURE_FILE, windows=(30,)).update().frame("Temperature"))
+
+# Called with the same arguments as by warmup.py
+def changes_figure(year, animate):
+  if animate:
+    return(plots.changes_plot(year, plots.CHANGES_ANIMATION_RANGE_X, True))
+  return(plots.changes_plot(year, None))
+
+def changes_scope(year, animate):
+  return(plots.changes_scope(year, None, animate))
+
+def scatter_scope(year, to_end):
+  return(plots.changes_scope(year, None, to_end))
+
+def sectors_scope(*params):
+  return(plots.no_scope())
+
+
+# name -> (function, {parameter: (type, default)}, scope of the response as in datacache.versioned)
+ENDPOINTS = {
+  "version": (version_data, {}, None),
+  "forecasts": (forecasts_data, {"country": (str, REQUIRED)}, plots.country_scope),
+  "history": (history_data, {"country": (str, REQUIRED), "from_year": (int, plots.HISTORY_START_YEAR)}, plots.country_scope),
+  "map": (map_data, {"metric": (str, "co2_per_capita"), "year": (int, REQUIRED)}, plots.map_scope),
+  "scatter": (scatter_data, {"year": (int, REQUIRED), "to_end": (bool, False)}, scatter_scope),
+  "sectors": (sectors_data, {"gas": (str, "ghg"), "measure": (str, "share_pct"), "entity": (str, "World"), "year": (int, None),
+                             "by": (str, "sector")}, sectors_scope),
+  "temperature": (temperature_data, {}, plots.no_scope),
+  "figures/emissions_history_plot": (plots.emissions_history_plot, {"country": (str, REQUIRED), "from_year": (int, plots.HISTORY_START_YEAR)},
+                                     plots.country_scope),
+  "figures/changes_plot": (changes_figure, {"year": (int, REQUIRED), "animate": (bool, False)}, changes_scope),
+  "figures/world_temperature": (plots.world_temperature, {}, plots.no_scope),
+  "figures/sector_breakdown": (plots.sector_breakdown, {}, plots.no_scope),
+  "figures/map_html": (plots.map_html, {"metric": (str, "co2_per_capita"), "year": (int, REQUIRED)}, plots.map_scope),
+  "figures/map_slider_html": (plots.map_slider_html, {"metric": (str, "co2_per_capita"), "year": (int, REQUIRED)}, plots.map_series_scope)
+}
+
+
+def parse_value(text, kind):
+  if kind is bool:
+    if text.lower() not in ("1", "0", "true", "false"):
+      raise ValueError("%r is not a boolean" % text)
+    return(text.lower() in ("1", "true"))
+  return(kind(text))
+
+# The parameters of a request as a tuple of (name, value) in the order of the endpoint's parameters, raises ValueError for missing or malformed ones
+def parse_params(endpoint, arguments):
+  params = []
+  for name, (kind, default) in ENDPOINTS[endpoint][1].items():
+    if name in arguments:
+      try:
+        params.append((name, parse_value(arguments[name][-1].decode(), kind)))
+      except ValueError:
+        raise ValueError("%s must be %s" % (name, kind.__name__))
+    elif default is REQUIRED:
+      raise ValueError("%s is required" % name)
+    else:
+      params.append((name, default))
+  unknown = set(arguments) - set(ENDPOINTS[endpoint][1])
+  if unknown:
+    raise ValueError("unknown parameters %s" % ", ".join(sorted(unknown)))
+  return(tuple(params))
+
+
+def json_default(value):
+  if isinstance(value, pd.DataFrame):
+    return(json.loads(value.to_json(orient="records")))
+  if isinstance(value, np.generic):
+    return(value.item())
+  raise TypeError("%s is not JSON serializable" % type(value).__name__)
+
+# (content type, body) of a value: plotly figures as their JSON, html as it is, the rest as JSON with tables as a list of rows
+def encode(value):
+  if hasattr(value, "to_plotly_json"):
+    return("application/json", value.to_json().encode())
+  if isinstance(value, str):
+    return("text/html; charset=UTF-8", value.encode())
+  return("application/json", json.dumps(value, default=json_default, separators=(",", ":")).encode())
+
+
+def response_scope(endpoint, params):
+  scope = ENDPOINTS[endpoint][2]
+  return(scope(*[value for name, value in params]) if scope else None)
+
+# (ETag, content type, body) of a request. The parameters are passed by position like the page does, so the figures are the same
+# datacache and figurestore entries
+@versioned(maxsize=RESPONSE_CACHE_SIZE, scope=response_scope)
+def response(endpoint, params):
+  content_type, body = encode(ENDPOINTS[endpoint][0](*[value for name, value in params]))
+  return('"%s"' % hashlib.sha1(body).hexdigest()[:20], content_type, body)
+
+
+def checked_response(endpoint, params):
+  for name, value in params:
+    if name in CHECKS:
+      CHECKS[name](value)
+  return(response(endpoint, params))
+
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=COMPUTE_THREADS, thread_name_prefix="api")
+
+
+class BaseHandler(tornado.web.RequestHandler):
+
+  def write_error(self, status_code, **kwargs):
+    message = self._reason
+    if "exc_info" in kwargs and isinstance(kwargs["exc_info"][1], tornado.web.HTTPError) and kwargs["exc_info"][1].log_message:
+      message = kwargs["exc_info"][1].log_message
+    self.finish({"error": message})
+
+
+class EndpointHandler(BaseHandler):
+
+  async def get(self, endpoint):
+    if endpoint not in ENDPOINTS:
+      raise tornado.web.HTTPError(404, "no endpoint %s, see /api" % endpoint)
+    try:
+      params = parse_params(endpoint, self.request.arguments)
+    except ValueError as e:
+      raise tornado.web.HTTPError(400, str(e))
+    try:
+      self.etag, content_type, body = await tornado.ioloop.IOLoop.current().run_in_executor(_executor, checked_response, endpoint, params)
+    except NotFound as e:
+      raise tornado.web.HTTPError(404, str(e))
+    except ValueError as e:
+      # Parameters that are well formed but have no data
+      raise tornado.web.HTTPError(400, str(e))
+    self.set_header("Content-Type", content_type)
+    self.set_header("Cache-Control", "public, max-age=%d" % MAX_AGE)
+    # tornado answers 304 without the body when the request's If-None-Match has the ETag
+    self.write(body)
+
+  def compute_etag(self):
+    return(self.etag)
+
+
+class IndexHandler(BaseHandler):
+
+  def get(self):
+    self.finish({name: {param: {"type": kind.__name__, "default": None if default is REQUIRED else default, "required": default is REQUIRED}
+                        for param, (kind, default) in spec.items()}
+                 for name, (function, spec, scope) in ENDPOINTS.items()})
+
+
+def make_app():
+  return(tornado.web.Application([
+    (r"/api/?", IndexHandler),
+    (r"/api/(.+)", EndpointHandler)
+  ]))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Serve the data and figures of the app as JSON")
+  parser.add_argument("--port", type=int, default=PORT)
+  args = parser.parse_args()
+
+  assets.start()
+  make_app().listen(args.port)
+  print("Serving the data API on http://localhost:%d/api" % args.port)
+  tornado.ioloop.IOLoop.current().start()
@@ -0,0 +1,97 @@
+import concurrent.futures
+import threading
+import time
+
+import datacache
+import instrumentation
+
+# Loads the data files of the app in background threads as soon as the server runs the page for the first time, so that a cold start
+# takes about as long as the slowest file instead of all of them one after another. Every asset fills the datacache values the page
+# uses, so a section waits for the assets it needs (wait) and then gets the data from the cache.
+# Threads and not processes: the values have to end up in this process's cache. Reading parquet and the file i/o release the GIL.
+# When a data file changes (see datacache.on_invalidate) all the assets are loaded again in the background.
+
+def load_owid():
+  from util import owid_index
+  owid_index()
+
+def load_countries():
+  from countries import country_geo
+  from geometry import geometry_source
+  country_geo()
+  geometry_source()
+
+def load_forecasts():
+  from forecasts import forecast_index
+  forecast_index()
+
+def load_sectors():
+  from sectors import sector_cube
+  sector_cube()
+
+def load_temperature():
+  from plots import TEMPERATURE_FILE
+  from temperature import temperature_feed
+  temperature_feed(TEMPERATURE_FILE).update()
+
+# name -> function loading it
+ASSETS = {
+  "owid": load_owid,
+  "countries": load_countries,
+  "forecasts": load_forecasts,
+  "sectors": load_sectors,
+  "temperature": load_temperature
+}
+
+_lock = threading.Lock()
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(ASSETS), thread_name_prefix="assets")
+# name -> future of the load in progress or done
+_futures = {}
+# name -> {"started", "load_s", "error"} of the last load
+_loads = {}
+
+
+def load(name):
+  start = time.perf_counter()
+  error = None
+  try:
+    ASSETS[name]()
+  except Exception as e:
+    error = repr(e)
+  seconds = time.perf_counter() - start
+  with _lock:
+    _loads[name].update({"load_s": seconds, "error": error})
+  if instrumentation.ENABLED:
+    instrumentation.record("asset", "load " + name, seconds)
+
+
+# Starts loading the assets that are not loaded or loading yet. reload: load all of them again
+def start(reload=False):
+  with _lock:
+    for name in ASSETS:
+      if reload or name not in _futures:
+        _loads[name] = {"started": time.time(), "load_s": None, "error": None}
+        _futures[name] = _executor.submit(load, name)
+
+def reload():
+  start(reload=True)
+
+datacache.on_invalidate(reload)
+
+
+# Blocks until the assets are loaded. An asset that failed to load is not raised here: the section computes it itself and shows the error.
+def wait(*names):
+  start()
+  with _lock:
+    futures = [_futures[name] for name in names]
+  began = time.perf_counter()
+  concurrent.futures.wait(futures)
+  if instrumentation.ENABLED:
+    instrumentation.record("asset", "wait " + "+".join(names), time.perf_counter() - began)
+
+
+# The last load of every asset: started (time), load_s (None while loading) and error
+def load_table():
+  import pandas as pd
+  with _lock:
+    return(pd.DataFrame.from_dict({name: dict(load) for name, load in _loads.items()}, orient="index").rename_axis("asset").reset_index())
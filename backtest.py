@@ -0,0 +1,140 @@
+# Rolling-origin backtest of the forecasts of the app (forecasts.FORECASTS), to choose predict_time and train_from:
+#   python backtest.py --origins 2000 2015 --predict-time 3 5 --train-from 1970 1980 1990 --workers 8
+# For every origin year the data is cut after the origin, as if it was the last year recorded, and forecast with forecasts.batch_forecast,
+# the model the app uses, for all the countries at once. The forecasts are compared with what was recorded after the origin.
+# Origins are run in parallel on a process pool. A worker reads the data once and cuts it once per origin, for all the targets,
+# train_from and predict_time values of that origin.
+# Writes a row per target, train_from, predict_time, origin, country and horizon (years after the origin) to BACKTEST_FILE,
+# and prints the errors by horizon. error_table(pd.read_parquet(BACKTEST_FILE), KEY + ["country"]) gives them per country.
+import argparse
+import functools
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from forecasts import FORECASTS, PREDICT_TIME, forecast_columns, forecast_data, forecast_targets
+
+BACKTEST_FILE = "backtest.parquet"
+# Columns of BACKTEST_FILE
+BACKTEST_COLUMNS = ["target", "train_from", "predict_time", "origin", "country", "horizon", "estimate", "lci", "uci", "actual"]
+KEY = ["target", "train_from", "predict_time", "horizon"]
+
+
+# The data of the forecasts, read once per worker
+@functools.lru_cache(maxsize=None)
+def backtest_data():
+  from util import owid_dataset
+  return(owid_dataset()[forecast_columns()].astype({"country": object}))
+
+# The recorded values of every target indexed by country and year
+@functools.lru_cache(maxsize=None)
+def recorded():
+  return(forecast_data(backtest_data()).set_index(["country", "year"]))
+
+# The data as it was when origin was the last year, shared by all the forecasts from that origin
+@functools.lru_cache(maxsize=4)
+def data_until(origin):
+  df = backtest_data()
+  return(df[df.year <= origin])
+
+
+# Forecasts from one origin for every target, train_from and predict_time, with the recorded values.
+# train_froms None: the train_from of each target in FORECASTS. The targets and predict_times of a train_from are forecast together,
+# sharing the feature matrices of the countries
+def backtest_origin(origin, targets, train_froms, predict_times):
+  df = data_until(origin)
+  actual = recorded()
+  tables = []
+  for train_from in train_froms or [None]:
+    forecast = forecast_targets(df, targets, predict_times, train_from, False)
+    # Only what was forecast for after the origin can be checked
+    forecast = forecast[forecast.year > origin].reset_index(drop=True)
+    values = np.full(len(forecast), np.nan)
+    for target in targets:
+      rows = (forecast.target == target).values
+      values[rows] = actual[target].reindex(pd.MultiIndex.from_arrays([forecast.country[rows], forecast.year[rows]])).values
+    if train_from is None:
+      train_from = forecast.target.map({target: spec["train_from"] for target, spec in FORECASTS.items()})
+    tables.append(forecast.assign(train_from=train_from, origin=origin, horizon=forecast.year - origin, actual=values))
+  return(pd.concat(tables, ignore_index=True)[BACKTEST_COLUMNS] if tables else pd.DataFrame(columns=BACKTEST_COLUMNS))
+
+
+def run_origin(task):
+  start = time.perf_counter()
+  return(task[0], backtest_origin(*task), time.perf_counter() - start)
+
+
+# All the origins on a pool of workers. Returns the compactly typed results, sorted
+def backtest(origins, targets, train_froms, predict_times, workers):
+  tasks = [(origin, targets, train_froms, predict_times) for origin in origins]
+  tables = []
+  start = time.perf_counter()
+  # Workers are started fresh like in warmup.py, and every one reads the data itself
+  with multiprocessing.get_context("spawn").Pool(workers) as pool:
+    for origin, table, seconds in pool.imap_unordered(run_origin, tasks):
+      tables.append(table)
+      print("origin %d: %d forecasts in %.1f s [%d/%d, %.1f s]" % (origin, len(table), seconds, len(tables), len(tasks),
+                                                                   time.perf_counter() - start), flush=True)
+  results = pd.concat(tables, ignore_index=True)
+  results = results.sort_values(["target", "train_from", "predict_time", "origin", "country", "horizon"]).reset_index(drop=True)
+  types = {"target": "category", "country": "category", "train_from": "int16", "predict_time": "int8", "origin": "int16", "horizon": "int8"}
+  types.update({column: "float32" for column in ["estimate", "lci", "uci", "actual"]})
+  return(results.astype(types))
+
+
+# Errors of the forecasts by the by columns: number of forecasts checked, mean absolute error, median and mean absolute percentage error,
+# bias (mean percentage error, positive: too high) and the share of recorded values inside the prediction interval
+def error_table(results, by=KEY):
+  df = results[results.actual.notnull() & results.estimate.notnull()]
+  error = df.estimate.astype(float) - df.actual.astype(float)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    pct = (100 * error / df.actual.abs()).replace([np.inf, -np.inf], np.nan)
+  df = df.assign(abs_error=error.abs(), ape=pct.abs(), pe=pct, covered=(df.actual >= df.lci) & (df.actual <= df.uci))
+  return(df.groupby(by, observed=True).agg(
+    forecasts=("abs_error", "size"), mae=("abs_error", "mean"), median_ape=("ape", "median"), mape=("ape", "mean"), bias_pct=("pe", "mean"),
+    coverage=("covered", "mean")
+  ).reset_index())
+
+
+# The checked forecasts of the horizons that every train_from and predict_time of their target has. A longer predict_time adds
+# far horizons, which have larger errors, so the values are only comparable over the horizons they share
+def shared_horizons(results):
+  df = results[results.actual.notnull() & results.estimate.notnull()]
+  tables = []
+  for target, rows in df.groupby("target", observed=True):
+    horizons = rows.groupby(["train_from", "predict_time"]).horizon.unique()
+    tables.append(rows[rows.horizon.isin(set.intersection(*[set(h) for h in horizons]))])
+  return(pd.concat(tables) if tables else df)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Backtest the emission forecasts from rolling origins")
+  parser.add_argument("--origins", type=int, nargs=2, metavar=("FIRST", "LAST"), help="first and last origin year (default 2000 to the year before the last)")
+  parser.add_argument("--targets", nargs="*", choices=list(FORECASTS), default=list(FORECASTS))
+  parser.add_argument("--train-from", type=int, nargs="*", help="train_from values (default the one of each target)")
+  parser.add_argument("--predict-time", type=int, nargs="*", default=[PREDICT_TIME])
+  parser.add_argument("--workers", type=int, default=os.cpu_count())
+  parser.add_argument("--output", default=BACKTEST_FILE)
+  args = parser.parse_args()
+
+  last_year = int(backtest_data().year.max())
+  first, last = args.origins or (2000, last_year - 1)
+  origins = range(first, min(last, last_year - 1) + 1)
+  if not len(origins):
+    sys.exit("No origins: the last year of the data is %d" % last_year)
+  print("Backtesting %s from %d origins (%d-%d) with %d workers" % (", ".join(args.targets), len(origins), origins[0], origins[-1], args.workers))
+  results = backtest(origins, args.targets, args.train_from, args.predict_time, args.workers)
+  results.to_parquet(args.output, index=False)
+  print(len(results), "forecasts written to", args.output)
+
+  pd.set_option("display.width", 200)
+  print(error_table(results).to_string(index=False, float_format="%.2f"))
+  shared = shared_horizons(results)
+  overall = error_table(shared, ["target", "train_from", "predict_time"])
+  overall["max_horizon"] = overall.target.map(shared.groupby("target", observed=True).horizon.max()).astype(int)
+  print("\nBest by median absolute percentage error, over the horizons all the values of a target forecast (1 to max_horizon):")
+  print(overall.sort_values("median_ape").groupby("target", observed=True).head(1).to_string(index=False, float_format="%.2f"))
@@ -0,0 +1,198 @@
+# Benchmarks of the data and plotting pipeline, with the caches cleared before every run.
+# Runs on the real data files, or with --synthetic on generated OWID-shaped data of any size.
+# Reports wall time, peak (Python) memory and the size of each output, and saves the results so they can be compared across commits:
+#   python benchmark.py --save benchmarks/before.json
+#   python benchmark.py --compare benchmarks/before.json
+#   python benchmark.py --synthetic 500 300 60
+import argparse
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Data files the app reads besides the OWID data, linked into the folder of a synthetic run
+ASSET_FILES = ["world-countries.json", "globalTemperature.csv", "res/Global-GHG-Emissions-by-sector-based-on-WRI-2020.xlsx",
+               "res/ghg-emissions-by-sector.csv", "res/co-emissions-by-sector.csv", "res/per-capita-ghg-sector.csv"]
+
+
+# OWID-shaped data: countries x years rows with the columns the app uses plus extra_columns filler columns.
+# The first countries are the ones on the map, the rest get made up names. World and Europe are included as aggregates.
+def synthetic_owid(countries, years, extra_columns=0, seed=0):
+  rng = np.random.default_rng(seed)
+  with open(os.path.join(REPO_DIR, "world-countries.json")) as f:
+    features = [(feature["id"], feature["properties"]["name"]) for feature in json.load(f)["features"] if feature["id"] != "-99"]
+  entities = [("OWID_WRL", "World"), (None, "Europe")] + features[:max(countries - 2, 0)]
+  entities += [("S%03d" % i, "Synthetic country %d" % i) for i in range(countries - len(entities))]
+
+  year = np.tile(np.arange(2020 - years + 1, 2021), len(entities))
+  t = (year - year.min()) / max(years - 1, 1)
+  n = len(year)
+  base = np.repeat(rng.uniform(1, 500, len(entities)), years)
+  population = np.repeat(rng.uniform(1e5, 1e8, len(entities)), years) * (1 + t) ** 1.5 * rng.uniform(0.98, 1.02, n)
+  co2 = base * (1 + 2 * t) + rng.normal(0, 5, n)
+  df = pd.DataFrame({
+    "iso_code": np.repeat([iso for iso, name in entities], years),
+    "country": np.repeat([name for iso, name in entities], years),
+    "year": year,
+    "co2": co2,
+    "co2_growth_prct": rng.normal(2, 10, n),
+    "co2_per_capita": co2 * 1e6 / population,
+    "methane": np.where(year >= 1990, base / 3 + 100 * t, np.nan),
+    "nitrous_oxide": np.where(year >= 1990, base / 10 + 20 * t, np.nan),
+    "population": population,
+    "gdp": np.where(year < 2019, population * 1000 * (1 + t), np.nan),
+    "energy_per_capita": np.where((year >= 1965) & (year <= 2019), 1000 + 5000 * t + rng.normal(0, 40, n), np.nan)
+  })
+  df["total_ghg"] = df.co2 + df.methane + df.nitrous_oxide
+  for i in range(extra_columns):
+    df["extra_%d" % i] = rng.normal(size=n)
+  return(df)
+
+
+# Folder with a synthetic OWID csv and links to the other data files
+def synthetic_workspace(countries, years, extra_columns):
+  folder = tempfile.mkdtemp(prefix="owid-benchmark-")
+  os.makedirs(os.path.join(folder, "res"))
+  for asset in ASSET_FILES:
+    os.symlink(os.path.join(REPO_DIR, asset), os.path.join(folder, asset))
+  from util import OWID_CSV
+  synthetic_owid(countries, years, extra_columns).to_csv(os.path.join(folder, OWID_CSV), index=False)
+  return(folder)
+
+
+# Clears the data cache, so every run computes everything it needs
+def clear_caches():
+  import datacache
+  datacache.invalidate()
+
+
+# Size of what a function returns, as it would be sent to the browser (figures and maps) or held in memory (tables)
+def payload_size(result):
+  if isinstance(result, tuple):
+    return(sum(payload_size(r) for r in result))
+  if isinstance(result, pd.DataFrame):
+    return(int(result.memory_usage(deep=True).sum()))
+  if hasattr(result, "add_to"):
+    import folium
+    m = folium.Map(zoom_start=1)
+    result.add_to(m)
+    return(len(m.get_root().render()))
+  if hasattr(result, "to_json"):
+    return(len(result.to_json()))
+  return(0)
+
+
+def benchmark_cases():
+  import util, plots, forecasts
+  last_year = int(util.max_year.__wrapped__())
+  return({
+    "util.get_OWID_data": lambda: util.get_OWID_data(),
+    "util.owid_dataset": lambda: util.owid_dataset(),
+    "util.load_data": lambda: util.load_data(plots.MAP_START_YEAR, last_year),
+    "plots.heatmap": lambda: plots.heatmap("co2_per_capita", last_year - 1),
+    "forecasts.build_forecast_table": lambda: forecasts.build_forecast_table(),
+    "forecasts.forecast_targets": lambda: forecasts.forecast_targets(util.owid_dataset()[forecasts.forecast_columns()].astype({"country": object}),
+                                                                     forecasts.FORECASTS, range(1, 11)),
+    "plots.emissions_history_plot": lambda: plots.emissions_history_plot("World", 1850),
+    "plots.changes_plot": lambda: plots.changes_plot(last_year - 2, None),
+    "plots.sector_breakdown": lambda: plots.sector_breakdown(),
+    "plots.world_temperature": lambda: plots.world_temperature()
+  })
+
+
+# The measurements of a case, or {"error": the traceback} if it fails
+def run_case(case, repeat):
+  times, peaks = [], []
+  for _ in range(repeat):
+    clear_caches()
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+      result = case()
+    except Exception:
+      tracemalloc.stop()
+      return({"error": traceback.format_exc()})
+    times.append(time.perf_counter() - start)
+    peaks.append(tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+  return({"time_s": min(times), "median_time_s": float(np.median(times)), "peak_memory_mb": max(peaks) / 2**20,
+          "payload_kb": payload_size(result) / 1024})
+
+
+def run(repeat=3, only=None):
+  import figurestore
+  # The figures are measured being computed, not read from the disk store
+  figurestore.STORE_DIR = ""
+  results = {}
+  for name, case in benchmark_cases().items():
+    if only and not any(o in name for o in only):
+      continue
+    results[name] = run_case(case, repeat)
+    if "error" in results[name]:
+      print("%-40s FAILED\n%s" % (name, results[name]["error"]))
+      continue
+    print("%-40s %8.3f s %9.1f MB %10.1f KB" % (name, results[name]["time_s"], results[name]["peak_memory_mb"], results[name]["payload_kb"]))
+  return(results)
+
+
+def compare(results, baseline):
+  print("\n%-40s %10s %10s %10s" % ("compared to " + baseline["commit"][:10], "time", "memory", "payload"))
+  for name, result in results.items():
+    if name not in baseline["results"] or "error" in result or "error" in baseline["results"][name]:
+      continue
+    before = baseline["results"][name]
+    ratios = [result[key] / before[key] if before[key] else float("nan") for key in ["time_s", "peak_memory_mb", "payload_kb"]]
+    print("%-40s %9.2fx %9.2fx %9.2fx" % (name, *ratios))
+
+
+def git_commit():
+  try:
+    return(subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip())
+  except (OSError, subprocess.CalledProcessError):
+    return("unknown")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the data and plotting pipeline")
+  parser.add_argument("--synthetic", nargs=3, type=int, metavar=("COUNTRIES", "YEARS", "EXTRA_COLUMNS"),
+                      help="use generated OWID-shaped data instead of the real files")
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--only", nargs="*", help="run only the benchmarks whose name contains one of these")
+  parser.add_argument("--save", help="write the results to this json file")
+  parser.add_argument("--compare", help="compare the results to a json file written with --save")
+  args = parser.parse_args()
+
+  sys.path.insert(0, REPO_DIR)
+  save = os.path.abspath(args.save) if args.save else None
+  baseline = os.path.abspath(args.compare) if args.compare else None
+  folder = REPO_DIR
+  if args.synthetic:
+    folder = synthetic_workspace(*args.synthetic)
+  os.chdir(folder)
+  try:
+    results = run(args.repeat, args.only)
+  finally:
+    if args.synthetic:
+      shutil.rmtree(folder)
+
+  report = {"commit": git_commit(), "dataset": "synthetic %dx%dx%d" % tuple(args.synthetic) if args.synthetic else "real",
+            "python": sys.version.split()[0], "repeat": args.repeat, "results": results}
+  if baseline:
+    with open(baseline) as f:
+      compare(results, json.load(f))
+  if save:
+    os.makedirs(os.path.dirname(save), exist_ok=True)
+    with open(save, "w") as f:
+      json.dump(report, f, indent=2)
+  sys.exit(1 if any("error" in result for result in results.values()) else 0)
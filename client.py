@@ -0,0 +1,130 @@
+import collections
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import json
+import os
+
+# What world_map.py shows, from the data API (api.py) when DATA_API_URL is set (e.g. http://localhost:8600/api),
+# computed in this process otherwise. With the API the streamlit server only renders the page, the data and figures are
+# computed, cached and scaled separately.
+# Responses are kept and revalidated with their ETag, so an unchanged figure is neither sent again nor parsed again.
+API_URL = os.environ.get("DATA_API_URL", "").rstrip("/")
+# Seconds to wait for the API
+TIMEOUT = 60
+# Number of responses kept
+CACHE_SIZE = 256
+
+_lock = threading.Lock()
+# url -> (ETag, value)
+_responses = collections.OrderedDict()
+
+
+def parse_figure(body):
+  from figurestore import plotly_load
+  return(plotly_load(body.decode()))
+
+def parse_json(body):
+  return(json.loads(body))
+
+def parse_html(body):
+  return(body.decode())
+
+
+# The value of an endpoint, parse makes it from the body of the response
+def fetch(endpoint, parse=parse_json, **params):
+  url = API_URL + "/" + endpoint
+  if params:
+    url += "?" + urllib.parse.urlencode(params)
+  with _lock:
+    cached = _responses.get(url)
+  request = urllib.request.Request(url)
+  if cached and cached[0]:
+    request.add_header("If-None-Match", cached[0])
+  try:
+    with urllib.request.urlopen(request, timeout=TIMEOUT) as f:
+      etag, value = f.headers.get("ETag"), parse(f.read())
+  except urllib.error.HTTPError as e:
+    if e.code == 304 and cached:
+      etag, value = cached
+    else:
+      raise RuntimeError("%s: %s %s" % (url, e.code, e.read().decode(errors="replace")))
+  with _lock:
+    _responses[url] = (etag, value)
+    _responses.move_to_end(url)
+    while len(_responses) > CACHE_SIZE:
+      _responses.popitem(last=False)
+  return(value)
+
+
+# Loading of the data files (assets.py), only when the data is computed in this process
+def start_loading():
+  if not API_URL:
+    import assets
+    assets.start()
+
+def wait(*names):
+  if not API_URL:
+    import assets
+    assets.wait(*names)
+
+
+# Changes when the data changes
+def data_version():
+  if not API_URL:
+    import datacache
+    return(datacache.dataset_version())
+  return(fetch("version")["version"])
+
+# The region list and first years of the page (map_start_year, history_regions, history_start_year). From the API the page does not
+# import plots, which would load the data modules
+def page_constants():
+  if not API_URL:
+    import plots
+    return({"map_start_year": plots.MAP_START_YEAR, "history_regions": plots.HISTORY_REGIONS, "history_start_year": plots.HISTORY_START_YEAR})
+  return(fetch("version"))
+
+def max_year():
+  if not API_URL:
+    from util import max_year
+    return(int(max_year()))
+  return(fetch("version")["max_year"])
+
+def world_temperature():
+  if not API_URL:
+    from plots import world_temperature
+    return(world_temperature())
+  return(fetch("figures/world_temperature", parse_figure))
+
+def emissions_history_plot(country, from_year):
+  if not API_URL:
+    from plots import emissions_history_plot
+    return(emissions_history_plot(country, from_year))
+  return(fetch("figures/emissions_history_plot", parse_figure, country=country, from_year=from_year))
+
+def map_html(metric, year):
+  if not API_URL:
+    from plots import map_html
+    return(map_html(metric, year))
+  return(fetch("figures/map_html", parse_html, metric=metric, year=year))
+
+def map_slider_html(metric, year):
+  if not API_URL:
+    from plots import map_slider_html
+    return(map_slider_html(metric, year))
+  return(fetch("figures/map_slider_html", parse_html, metric=metric, year=year))
+
+def changes_plot(year, animate=False):
+  if not API_URL:
+    from plots import changes_plot, CHANGES_ANIMATION_RANGE_X
+    if animate:
+      return(changes_plot(year, CHANGES_ANIMATION_RANGE_X, True))
+    return(changes_plot(year, None))
+  return(fetch("figures/changes_plot", parse_figure, year=year, animate=int(animate)))
+
+def sector_breakdown():
+  if not API_URL:
+    from plots import sector_breakdown
+    return(sector_breakdown())
+  return(fetch("figures/sector_breakdown", parse_figure))
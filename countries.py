@@ -0,0 +1,74 @@
+import pandas as pd
+import numpy as np
+import json
+import os
+
+from util import owid_dataset
+import datacache
+from datacache import versioned
+
+GEO_FILE = "world-countries.json"
+# Join table written by ingest.py
+COUNTRY_INDEX = "country-index.parquet"
+datacache.watch_file(GEO_FILE)
+datacache.watch_file(COUNTRY_INDEX)
+
+# OWID gives regions and other aggregates either no iso code or an OWID_ one. Kosovo is the only real country among those.
+OWID_COUNTRY_CODES = ["OWID_KOS"]
+
+
+# Country identity index, one row per OWID entity:
+# country_id (integer id used for all joins), country (OWID name), iso_code, is_aggregate (region/group flag),
+# geo_name (name of the matching world-countries.json feature, NaN if it is not on the map)
+def build_country_index(owid, geo):
+  index = owid[["country", "iso_code"]].drop_duplicates("country").sort_values("country").reset_index(drop=True)
+  iso = index.iso_code.astype(object)
+  index["iso_code"] = iso
+  index["is_aggregate"] = iso.isnull() | (iso.str.startswith("OWID_") & ~iso.isin(OWID_COUNTRY_CODES)).fillna(False)
+  index.insert(0, "country_id", np.arange(len(index), dtype="int32"))
+
+  features = pd.DataFrame({
+    "geo_id": [feature["id"] for feature in geo["features"]],
+    "geo_name": [feature["properties"]["name"] for feature in geo["features"]]
+  })
+  # Features with a proper ISO code are joined on it, the ones marked -99 (Kosovo, Somaliland, Northern Cyprus, Western Sahara) by name
+  with_iso = features[features.geo_id != "-99"].drop_duplicates("geo_id").set_index("geo_id").geo_name
+  without_iso = features[features.geo_id == "-99"].geo_name
+  index["geo_name"] = iso.map(with_iso)
+  by_name = index.country.where(index.country.isin(without_iso))
+  index["geo_name"] = index.geo_name.fillna(by_name)
+  index.loc[index.is_aggregate, "geo_name"] = np.nan
+  return(index)
+
+
+# OWID countries that are not on the map, and map features without OWID data
+def unmatched_countries(index, geo):
+  owid = index[~index.is_aggregate & index.geo_name.isnull()].country.tolist()
+  matched = set(index.geo_name.dropna())
+  features = [feature["properties"]["name"] for feature in geo["features"] if feature["properties"]["name"] not in matched]
+  return(owid, features)
+
+
+@versioned()
+def country_index():
+  if os.path.exists(COUNTRY_INDEX):
+    return(pd.read_parquet(COUNTRY_INDEX))
+  with open(GEO_FILE) as f:
+    geo = json.load(f)
+  return(build_country_index(owid_dataset()[["country", "iso_code"]].astype(object), geo))
+
+
+# Adds the country_id of each feature to its properties (-1 if there is no OWID data for it)
+def add_country_ids(geo, index):
+  ids = index.dropna(subset=["geo_name"]).set_index("geo_name").country_id
+  for feature in geo["features"]:
+    feature["properties"]["country_id"] = int(ids.get(feature["properties"]["name"], -1))
+  return(geo)
+
+
+# world-countries.json with country ids
+@versioned()
+def country_geo():
+  with open(GEO_FILE) as f:
+    geo = json.load(f)
+  return(add_country_ids(geo, country_index()))
@@ -0,0 +1,292 @@
+import collections
+import functools
+import hashlib
+import inspect
+import json
+import threading
+import time
+import sys
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrument_lru
+
+# Cache of everything computed from the data files. An entry is keyed on the (scalar) arguments only and every entry is dropped when
+# a data file changes, so unlike st.cache no DataFrame is ever hashed or copied: the output is returned as is.
+# Callers must not modify what they get back.
+# When a data file changes the on_invalidate callbacks are called after the cache has been emptied.
+# refresh.py records what part of the data a new version changes in CHANGES_FILE. Then only the values whose scope
+# (the countries and years they are computed from, see scope) has changed are dropped, and the swap of the files is atomic:
+# the old version is used until all the files of the new one are in place.
+
+# Memory of all the cached values together, least recently used values are dropped above it
+MAX_MB = float(os.environ.get("DATA_CACHE_MB", 1024))
+# The data files are checked for changes at most this often (seconds)
+CHECK_INTERVAL = 1.0
+# Written by refresh.py: a list of {"version", "previous", "countries", "years", "written"}, the newest last
+CHANGES_FILE = "data-changes.json"
+# A refresh that has not replaced all its files in this time (seconds) is taken to have failed
+SWAP_TIMEOUT = 60
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+# Every data file the app reads (a module reading one checks it is here with watch_file). The dataset version is a hash over all of
+# them, whichever modules a process has imported, so the app, warmup.py and api.py processes have the same version for the same files.
+DATA_FILES = [
+  # util.py
+  "owid-co2-data_25_11_2021.csv", "owid-co2-data_25_11_2021.parquet",
+  # countries.py
+  "world-countries.json", "country-index.parquet",
+  # forecasts.py
+  "forecasts.parquet",
+  # geometry.py
+  "res/geo/world-countries-low.json", "res/geo/world-countries-medium.json", "res/geo/world-countries-high.json",
+  # plots.py
+  "globalTemperature.csv",
+  # sectors.py
+  "./res/Global-GHG-Emissions-by-sector-based-on-WRI-2020.xlsx", "./res/ghg-emissions-by-sector.csv", "./res/co-emissions-by-sector.csv",
+  "./res/per-capita-ghg-sector.csv", "sector-cube.parquet"
+]
+
+_lock = threading.RLock()
+_digests = {}
+_callbacks = []
+# (function name, key) -> (value, size in MB, scope), in least recently used first order
+_entries = collections.OrderedDict()
+# digests: content hash of every data file when it was last checked (None until the first check), generation: number of invalidations
+_state = {"digests": None, "checked": 0.0, "generation": 0, "total_mb": 0.0, "changes": (None, [])}
+
+
+# Called by the modules that read a data file, a file missing from DATA_FILES would not be part of the dataset version
+def watch_file(path):
+  if path not in DATA_FILES:
+    raise ValueError("%s is not in datacache.DATA_FILES" % path)
+
+# Callback called with no arguments when a data file has changed, after the cache has been emptied
+def on_invalidate(callback):
+  _callbacks.append(callback)
+
+
+# Content hash of a file, only recomputed when its size or modification time changes. None if the file does not exist
+def file_digest(path):
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return(None)
+  stamp = (stat.st_size, stat.st_mtime_ns)
+  if path not in _digests or _digests[path][0] != stamp:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+      for chunk in iter(lambda: f.read(2**20), b""):
+        digest.update(chunk)
+    _digests[path] = (stamp, digest.hexdigest())
+  return(_digests[path][1])
+
+
+# The part of the data a cached value is computed from: countries (a list, None: all of them) and years (first, last) (None: all of them,
+# last None: all from first on). Values without a scope are dropped on any change.
+def scope(countries=None, years=None):
+  return({"countries": countries, "years": years})
+
+# True if a change recorded by refresh.py touches the data of the scope. A change with countries or years None changes everything.
+def affects(change, value_scope):
+  if value_scope is None or change is None or change["countries"] is None or change["years"] is None:
+    return(True)
+  countries = value_scope["countries"] is None or not set(value_scope["countries"]).isdisjoint(change["countries"])
+  years = value_scope["years"]
+  if years is not None:
+    first, last = years
+    years = any(year >= first and (last is None or year <= last) for year in change["years"])
+  return(countries and (years is None or years))
+
+
+def version_of(digests):
+  return(hashlib.sha1(repr(sorted(digests.items())).encode()).hexdigest()[:16])
+
+# Content hash of every data file, as of the last check. The files are hashed the first time it is needed, not at import
+def file_digests():
+  with _lock:
+    if _state["digests"] is None:
+      _state["digests"] = {path: file_digest(path) for path in DATA_FILES}
+    return(dict(_state["digests"]))
+
+
+# The changes recorded in CHANGES_FILE, reread when the file changes
+def read_changes():
+  try:
+    stamp = os.stat(CHANGES_FILE).st_mtime_ns
+  except OSError:
+    return([])
+  if _state["changes"][0] != stamp:
+    try:
+      with open(CHANGES_FILE) as f:
+        _state["changes"] = (stamp, json.load(f))
+    except (OSError, ValueError):
+      return([])
+  return(_state["changes"][1])
+
+
+# True while refresh.py is replacing the files of change: every file is either the old one or the one of the new version
+def swapping(change, old, new):
+  if time.time() - change["written"] > SWAP_TIMEOUT:
+    return(False)
+  files = change.get("files", {})
+  return(all(new[path] == old[path] or new[path] == files.get(path) for path in new))
+
+
+# Empties the cache, or the part of it a change touches, if a data file has changed since the last check
+def check_files():
+  with _lock:
+    now = time.monotonic()
+    if now - _state["checked"] < CHECK_INTERVAL:
+      return
+    _state["checked"] = now
+    current = file_digests()
+    digests = {path: file_digest(path) for path in DATA_FILES}
+    if digests == current:
+      return
+    old, new = version_of(current), version_of(digests)
+    changes = read_changes()
+    pending = [change for change in changes if change["previous"] == old and change["version"] != new]
+    if pending and swapping(pending[-1], current, digests):
+      return
+    change = next((change for change in reversed(changes) if change["previous"] == old and change["version"] == new), None)
+    _state["digests"] = digests
+  invalidate(change)
+
+
+# Fingerprint of all the data files
+def dataset_version():
+  check_files()
+  return(version_of(file_digests()))
+
+
+# The oldest dataset version the data of value_scope is the same in as in the current one, following the changes back
+def scope_version(value_scope):
+  version = dataset_version()
+  by_version = {change["version"]: change for change in read_changes()}
+  seen = set()
+  while version in by_version and version not in seen and not affects(by_version[version], value_scope):
+    seen.add(version)
+    version = by_version[version]["previous"]
+  return(version)
+
+
+# Empties the cache, or only drops the values change affects, and calls the on_invalidate callbacks
+def invalidate(change=None):
+  with _lock:
+    for entry, (value, size, value_scope) in list(_entries.items()):
+      if affects(change, value_scope):
+        del _entries[entry]
+        _state["total_mb"] -= size
+    _state["generation"] += 1
+  for callback in _callbacks:
+    callback()
+
+
+# Approximate memory of a cached value in MB
+def value_size(value, seen=None):
+  seen = set() if seen is None else seen
+  if id(value) in seen:
+    return(0.0)
+  seen.add(id(value))
+  if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+    size = value.memory_usage(deep=True)
+    return(float(np.sum(size)) / 2**20)
+  if isinstance(value, np.ndarray):
+    return(value.nbytes / 2**20)
+  size = sys.getsizeof(value) / 2**20
+  if isinstance(value, dict):
+    return(size + sum(value_size(v, seen) for v in value.values()))
+  if isinstance(value, (list, tuple, set)):
+    return(size + sum(value_size(v, seen) for v in value))
+  if hasattr(value, "__dict__"):
+    return(size + value_size(vars(value), seen))
+  return(size)
+
+
+def freeze(value):
+  if isinstance(value, (list, tuple)):
+    return(tuple(freeze(v) for v in value))
+  if isinstance(value, dict):
+    return(tuple(sorted((k, freeze(v)) for k, v in value.items())))
+  return(value)
+
+# Key of a call: its arguments by parameter name with the defaults filled in, so f(1, 2), f(1, b=2) and f(a=1) (with b=2 by default)
+# are the same value
+def call_key(signature, args, kwargs):
+  bound = signature.bind(*args, **kwargs)
+  bound.apply_defaults()
+  return(freeze(dict(bound.arguments)))
+
+
+# generation: the generation the value was computed in, values computed from data that has changed since are not stored
+def _store(name, key, value, size, value_scope, maxsize, generation):
+  with _lock:
+    if size > MAX_MB or generation != _state["generation"]:
+      return
+    _entries[(name, key)] = (value, size, value_scope)
+    _state["total_mb"] += size
+    if maxsize is not None:
+      own = [entry for entry in _entries if entry[0] == name]
+      for entry in own[:max(len(own) - maxsize, 0)]:
+        _state["total_mb"] -= _entries.pop(entry)[1]
+    while _state["total_mb"] > MAX_MB:
+      _state["total_mb"] -= _entries.popitem(last=False)[1][1]
+
+
+# Decorator caching a function of the data files. maxsize: number of values kept for the function (None: only the memory limit),
+# scope: function of the same arguments returning the scope of the value
+def versioned(maxsize=None, scope=None):
+  def decorator(func):
+    name = func.__module__ + "." + func.__qualname__
+    counts = {"hits": 0, "misses": 0}
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      check_files()
+      key = call_key(signature, args, kwargs)
+      with _lock:
+        generation = _state["generation"]
+        if (name, key) in _entries:
+          _entries.move_to_end((name, key))
+          counts["hits"] += 1
+          return(_entries[(name, key)][0])
+        counts["misses"] += 1
+      # Computed outside the lock, two sessions asking for the same value at once both compute it
+      value = func(*args, **kwargs)
+      _store(name, key, value, value_size(value), scope(*args, **kwargs) if scope else None, maxsize, generation)
+      return(value)
+
+    def cache_info():
+      with _lock:
+        return(CacheInfo(counts["hits"], counts["misses"], maxsize, sum(1 for entry in _entries if entry[0] == name)))
+
+    def cache_clear():
+      with _lock:
+        for entry in [entry for entry in _entries if entry[0] == name]:
+          _state["total_mb"] -= _entries.pop(entry)[1]
+
+    wrapper.cache_info = cache_info
+    wrapper.cache_clear = cache_clear
+    return(instrument_lru(wrapper))
+  return(decorator)
+
+
+# Number of values and memory in MB of each cached function, largest first. memory_mb counts everything a value holds,
+# own_mb only what is not part of a value cached before it (tables and dicts shared between functions are counted once)
+def memory_report():
+  seen = set()
+  with _lock:
+    sizes = [(name, size, value_size(value, seen)) for (name, key), (value, size, value_scope) in _entries.items()]
+  report = pd.DataFrame(sizes, columns=["function", "memory_mb", "own_mb"]).groupby("function")
+  report = report.agg(values=("memory_mb", "size"), memory_mb=("memory_mb", "sum"), own_mb=("own_mb", "sum"))
+  return(report.sort_values("own_mb", ascending=False))
+
+# Number of values and their memory in MB
+def cache_size():
+  with _lock:
+    return(len(_entries), _state["total_mb"])
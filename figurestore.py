@@ -0,0 +1,132 @@
+import functools
+import hashlib
+import inspect
+import tempfile
+import time
+import glob
+import os
+
+import datacache
+
+# Figures and map html kept on disk, so that a new process (a restart, another worker or replica sharing the folder) does not
+# compute them again. An entry is keyed on the dataset version, the code of the app and the arguments. With a scope (see datacache.scope)
+# the dataset version is the oldest one with the same data in the scope, so figures a refresh.py update does not touch are still used.
+# Files are written to a temporary file and renamed, so several processes can read and write the same folder.
+# FIGURE_STORE_DIR= (empty) turns the store off.
+STORE_DIR = os.environ.get("FIGURE_STORE_DIR", ".figure-store")
+# Size of the folder, the least recently used files are removed above it
+MAX_MB = float(os.environ.get("FIGURE_STORE_MB", 256))
+# Temporary files older than this (seconds) were left by a process that died while writing
+STALE_TMP = 3600
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def plotly_dump(fig):
+  return(fig.to_json())
+
+def plotly_load(data):
+  import plotly.io as pio
+  return(pio.from_json(data, skip_invalid=True))
+
+# kind -> (file extension, value to text, text to value)
+FORMATS = {
+  "plotly": (".json", plotly_dump, plotly_load),
+  "html": (".html", str, str)
+}
+
+
+# Hash of the app's source files, a new version of the code does not use the figures of the old one
+@functools.lru_cache(maxsize=None)
+def code_version():
+  digest = hashlib.sha1()
+  for path in sorted(glob.glob(os.path.join(APP_DIR, "*.py"))):
+    with open(path, "rb") as f:
+      digest.update(f.read())
+  return(digest.hexdigest()[:16])
+
+
+# The arguments are keyed by parameter name (see datacache.call_key), so positional and keyword calls share an entry
+def entry_path(name, signature, args, kwargs, kind, scope=None):
+  version = datacache.scope_version(scope(*args, **kwargs) if scope else None)
+  key = repr((name, version, code_version(), datacache.call_key(signature, args, kwargs)))
+  return(os.path.join(STORE_DIR, hashlib.sha1(key.encode()).hexdigest() + FORMATS[kind][0]))
+
+
+# Text of an entry, None if it is not stored. Reading an entry marks it as recently used
+def read_entry(path):
+  try:
+    with open(path, encoding="utf-8") as f:
+      data = f.read()
+    os.utime(path)
+  except OSError:
+    return(None)
+  return(data)
+
+
+def write_entry(path, data):
+  os.makedirs(STORE_DIR, exist_ok=True)
+  fd, tmp = tempfile.mkstemp(dir=STORE_DIR, suffix=".tmp")
+  try:
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+      f.write(data)
+    os.replace(tmp, path)
+  except BaseException:
+    os.unlink(tmp)
+    raise
+
+
+# Removes the least recently used files until the folder fits in MAX_MB. Files removed by another process at the same time are skipped
+def evict():
+  files = []
+  with os.scandir(STORE_DIR) as entries:
+    for entry in entries:
+      try:
+        stat = entry.stat()
+      except OSError:
+        continue
+      if entry.name.endswith(".tmp"):
+        if time.time() - stat.st_mtime > STALE_TMP:
+          files.append((0, 0, entry.path))
+        continue
+      files.append((stat.st_mtime, stat.st_size, entry.path))
+  files.sort()
+  total = sum(size for mtime, size, path in files)
+  for mtime, size, path in files:
+    if total <= MAX_MB * 2**20 and mtime:
+      break
+    try:
+      os.unlink(path)
+    except OSError:
+      pass
+    total -= size
+
+
+# Decorator storing what a function returns on disk, kind is a key of FORMATS and scope as in datacache.versioned
+def stored(kind, scope=None):
+  extension, dump, load = FORMATS[kind]
+  def decorator(func):
+    name = func.__module__ + "." + func.__qualname__
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      if not STORE_DIR:
+        return(func(*args, **kwargs))
+      path = entry_path(name, signature, args, kwargs, kind, scope)
+      data = read_entry(path)
+      if data is not None:
+        return(load(data))
+      value = func(*args, **kwargs)
+      try:
+        write_entry(path, dump(value))
+        evict()
+      except OSError:
+        # A read-only or full disk only costs the next process the computation
+        pass
+      return(value)
+
+    # Where a call is stored, e.g. plots.map_html.stored_path("co2", 2019). Kept by the decorators above this one (functools.wraps)
+    wrapper.stored_path = lambda *args, **kwargs: entry_path(name, signature, args, kwargs, kind, scope)
+    return(wrapper)
+  return(decorator)
@@ -0,0 +1,195 @@
+import pandas as pd
+import numpy as np
+import os
+
+from util import owid_dataset
+from timeseries import SeriesIndex
+import datacache
+from datacache import versioned
+
+# Forecast table written by ingest.py
+FORECAST_FILE = "forecasts.parquet"
+datacache.watch_file(FORECAST_FILE)
+PREDICT_TIME = 5
+# Forecasted column -> regressors, the columns that all have to be recorded for a year to be used,
+# training data starts after train_from, anchor: the forecast starts from the last recorded value so there is no gap in the plot.
+# The totals are in million tonnes of CO2 equivalent and the per capita values in tonnes per person, like in the OWID data.
+FORECASTS = {
+  "co2": {"regressors": ["year", "population", "energy_per_capita"], "required": ["co2", "population", "energy_per_capita"],
+    "train_from": 1980, "anchor": True},
+  "methane": {"regressors": ["population", "year"], "required": ["co2", "population", "methane"],
+    "train_from": 2000, "anchor": False},
+  "nitrous_oxide": {"regressors": ["population", "year"], "required": ["co2", "population", "nitrous_oxide"],
+    "train_from": 2000, "anchor": False},
+  "total_ghg": {"regressors": ["population", "year"], "required": ["co2", "population", "total_ghg"],
+    "train_from": 2000, "anchor": False},
+  "co2_per_capita": {"regressors": ["year", "population", "energy_per_capita"], "required": ["co2_per_capita", "population", "energy_per_capita"],
+    "train_from": 1980, "anchor": True},
+  "methane_per_capita": {"regressors": ["population", "year"], "required": ["co2", "population", "methane_per_capita"],
+    "train_from": 2000, "anchor": False},
+  "nitrous_oxide_per_capita": {"regressors": ["population", "year"], "required": ["co2", "population", "nitrous_oxide_per_capita"],
+    "train_from": 2000, "anchor": False},
+  "total_ghg_per_capita": {"regressors": ["population", "year"], "required": ["co2", "population", "total_ghg_per_capita"],
+    "train_from": 2000, "anchor": False}
+}
+# Per capita columns that are not in the OWID data -> the total they are computed from, see forecast_data
+PER_CAPITA = {"methane_per_capita": "methane", "nitrous_oxide_per_capita": "nitrous_oxide", "total_ghg_per_capita": "total_ghg"}
+# Columns of forecast_targets
+FORECAST_COLUMNS = ["country", "target", "predict_time", "year", "estimate", "lci", "uci"]
+# Country code * YEAR_KEY + year identifies a row of a FeatureMatrix
+YEAR_KEY = 10000
+
+
+# The OWID columns the forecasts of targets are made from
+def forecast_columns(targets=FORECASTS):
+  columns = set(["country", "year"])
+  for target in targets:
+    for column in FORECASTS[target]["regressors"] + FORECASTS[target]["required"]:
+      columns.update([PER_CAPITA[column], "population"] if column in PER_CAPITA else [column])
+  return(sorted(columns))
+
+# OWID data with the PER_CAPITA columns of the totals it has
+def forecast_data(df):
+  return(df.assign(**{column: df[total] * 1e6 / df.population for column, total in PER_CAPITA.items() if total in df}))
+
+
+# Rows of every country in a (country, row) array padded with zeros, rows[i] is put at (country_idx[i], position[i])
+def stack_rows(values, country_idx, position, n_countries):
+  stacked = np.zeros((n_countries, position.max() + 1) + values.shape[1:])
+  stacked[country_idx, position] = values
+  return(stacked)
+
+
+# The regressors of every country after train_from, built once and shared by the forecasts of all the targets and prediction times
+# with these regressors. The least squares fits are shared too: targets with the same training rows have the same pseudoinverse.
+# df: OWID data with country, year, the regressors and the columns of the targets (see forecast_data)
+class FeatureMatrix:
+
+  def __init__(self, df, regressors, train_from):
+    self.df = df[df.year > train_from].sort_values(["country", "year"]).reset_index(drop=True)
+    self.regressors = regressors
+    # Codes in the order of the countries, since the rows are sorted
+    self.codes, self.countries = pd.factorize(np.asarray(self.df.country, dtype=object))
+    self.years = self.df.year.values.astype(int)
+    self.X = self.df[regressors].values.astype(float)
+    self.complete = ~np.isnan(self.X).any(axis=1)
+    self.keys = self.codes.astype(np.int64) * YEAR_KEY + self.years
+    # training rows as bytes -> fit
+    self._fits = {}
+
+  # The last year every row's country has all the columns recorded, -1 if it has none
+  def last_year(self, columns):
+    recorded = self.df[columns].notnull().all(axis=1).values
+    last = np.full(len(self.countries), -1)
+    np.maximum.at(last, self.codes[recorded], self.years[recorded])
+    return(last[self.codes])
+
+  # Value of column in the row of the same country shift years later, NaN if there is no such row
+  def shifted(self, column, shift):
+    keys = self.keys + shift
+    i = np.minimum(np.searchsorted(self.keys, keys), len(keys) - 1)
+    return(np.where(self.keys[i] == keys, self.df[column].values.astype(float)[i], np.nan))
+
+  # Least squares through the pseudoinverse, like statsmodels OLS, for the training rows of every country at once.
+  # The zero rows used as padding do not change the fit.
+  def fit(self, training):
+    key = training.tobytes()
+    if key not in self._fits:
+      countries, idx, counts = np.unique(self.codes[training], return_inverse=True, return_counts=True)
+      position = np.arange(len(idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+      X = stack_rows(self.X[training], idx, position, len(countries))
+      pinv_X = np.linalg.pinv(X)
+      self._fits[key] = {"countries": countries, "idx": idx, "position": position, "X": X, "pinv_X": pinv_X,
+                         "normalized_cov": np.einsum("ckn,cjn->ckj", pinv_X, pinv_X), "df_resid": counts - np.linalg.matrix_rank(X)}
+    return(self._fits[key])
+
+  # Forecast of target predict_time years ahead for every country, see batch_forecast
+  def forecast(self, target, required, predict_time, anchor):
+    from scipy import stats
+    # The last year with all the data and the last year with the target recorded
+    data_year = self.last_year(required)
+    target_year = self.last_year([target])
+    # The target shift_by years later is predicted from the other variables. All other variables are from the past.
+    shift_by = predict_time + target_year - data_year
+    target_now = self.shifted(target, shift_by)
+    usable = (data_year >= 0) & (target_year >= 0)
+    training = usable & (self.years <= data_year - predict_time) & self.complete & ~np.isnan(target_now)
+    if not training.any():
+      return(pd.DataFrame({column: [] for column in ["country", "year", "estimate", "lci", "uci"]}))
+    fit = self.fit(training)
+    test = usable & (self.years > data_year - predict_time) & (self.years <= data_year) & np.isin(self.codes, fit["countries"])
+    test_idx = np.searchsorted(fit["countries"], self.codes[test])
+    X_test = self.X[test]
+
+    y = stack_rows(target_now[training], fit["idx"], fit["position"], len(fit["countries"]))
+    params = np.einsum("ckn,cn->ck", fit["pinv_X"], y)
+    ssr = ((y - np.einsum("cnk,ck->cn", fit["X"], params)) ** 2).sum(axis=1)
+    df_resid = fit["df_resid"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+      scale = np.where(df_resid > 0, ssr / df_resid, np.nan)
+
+    # Prediction intervals as in statsmodels' wls_prediction_std
+    prediction = np.einsum("tk,tk->t", X_test, params[test_idx])
+    prediction_std = np.sqrt(scale[test_idx] * (1 + np.einsum("tk,tkj,tj->t", X_test, fit["normalized_cov"][test_idx], X_test)))
+    t = stats.t.isf(0.025, np.maximum(df_resid, 1))[test_idx]
+    result = pd.DataFrame({
+      "country": self.countries[self.codes[test]],
+      "year": self.years[test] + shift_by[test],
+      "estimate": prediction,
+      "lci": (prediction - t * prediction_std) * 0.95,
+      "uci": (prediction + t * prediction_std) * 1.05
+    })
+
+    if anchor:
+      last = usable & (self.years == target_year) & np.isin(self.codes, fit["countries"])
+      value = self.df[target].values[last]
+      last = pd.DataFrame({"country": self.countries[self.codes[last]], "year": self.years[last], "estimate": value, "lci": value, "uci": value})
+      result = pd.concat([last, result])
+    return(result.sort_values(["country", "year"]).reset_index(drop=True))
+
+
+# Fits an OLS model for every country at once and forecasts target predict_time years ahead.
+# Returns a table with columns country, year, estimate, lci, uci (95% prediction interval, widened by 5%)
+def batch_forecast(df, target, regressors, required, predict_time, train_from, anchor):
+  return(FeatureMatrix(df, regressors, train_from).forecast(target, required, predict_time, anchor))
+
+
+# Forecasts of the targets (of FORECASTS) predict_times years ahead for every country of the OWID data df, in one table with
+# FORECAST_COLUMNS. train_from and anchor: the same for all the targets instead of the ones in FORECASTS.
+# The targets with the same regressors and train_from share one FeatureMatrix, so a gas more costs one more fit, not one more
+# feature matrix, and the gases with the same training rows share even the fit.
+def forecast_targets(df, targets=FORECASTS, predict_times=(PREDICT_TIME,), train_from=None, anchor=None):
+  df = forecast_data(df)
+  matrices = {}
+  tables = []
+  for target in targets:
+    spec = FORECASTS[target]
+    start = spec["train_from"] if train_from is None else train_from
+    key = (tuple(spec["regressors"]), start)
+    if key not in matrices:
+      matrices[key] = FeatureMatrix(df, spec["regressors"], start)
+    for predict_time in predict_times:
+      table = matrices[key].forecast(target, spec["required"], predict_time, spec["anchor"] if anchor is None else anchor)
+      tables.append(table.assign(target=target, predict_time=predict_time))
+  if not tables:
+    return(pd.DataFrame(columns=FORECAST_COLUMNS))
+  return(pd.concat(tables, ignore_index=True)[FORECAST_COLUMNS])
+
+
+# All the FORECASTS for all the countries in one table with columns country, target, year, estimate, lci, uci
+def build_forecast_table(predict_time=PREDICT_TIME):
+  df = owid_dataset()[forecast_columns()].astype({"country": object})
+  return(forecast_targets(df, FORECASTS, [predict_time]).drop(columns="predict_time"))
+
+
+@versioned()
+def forecast_table():
+  if os.path.exists(FORECAST_FILE):
+    return(pd.read_parquet(FORECAST_FILE))
+  return(build_forecast_table())
+
+
+# The forecast table indexed by country and year
+@versioned()
+def forecast_index():
+  return(SeriesIndex(forecast_table()))
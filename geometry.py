@@ -0,0 +1,107 @@
+import numpy as np
+import json
+import os
+import datacache
+from datacache import versioned
+
+# Simplified and quantized copies of world-countries.json (with country ids) for the map, written by ingest.py
+GEOMETRY_DIR = "res/geo"
+# detail level -> (Douglas-Peucker tolerance in degrees, decimals kept in the coordinates, zoom level from which it is used)
+GEOMETRY_LEVELS = {
+  "low": (0.5, 1, 0),
+  "medium": (0.15, 2, 3),
+  "high": (0.03, 3, 5)
+}
+# Level embedded in the map html when the geometry files are not served separately. The map opens at zoom 1.
+EMBEDDED_LEVEL = "low"
+# Address the browser loads the geometry files from, with {level} in place of the detail level,
+# e.g. https://example.com/geo/world-countries-{level}.json. Unset: the geometry is embedded in the map.
+GEOMETRY_URL = os.environ.get("GEOMETRY_URL")
+
+
+def geometry_file(level):
+  return(os.path.join(GEOMETRY_DIR, "world-countries-" + level + ".json"))
+
+for level in GEOMETRY_LEVELS:
+  datacache.watch_file(geometry_file(level))
+
+
+# Douglas-Peucker: keeps the points that are further than tolerance from the line through the points kept around them
+def simplify_line(points, tolerance):
+  keep = np.zeros(len(points), dtype=bool)
+  keep[0] = keep[-1] = True
+  stack = [(0, len(points) - 1)]
+  while stack:
+    start, end = stack.pop()
+    if end - start < 2:
+      continue
+    a, b = points[start], points[end]
+    between = points[start + 1:end]
+    dx, dy = b - a
+    length = np.hypot(dx, dy)
+    if length == 0:
+      distance = np.hypot(*(between - a).T)
+    else:
+      distance = np.abs(dx * (between[:, 1] - a[1]) - dy * (between[:, 0] - a[0])) / length
+    i = np.argmax(distance)
+    if distance[i] > tolerance:
+      stack.append((start, start + 1 + i))
+      stack.append((start + 1 + i, end))
+      keep[start + 1 + i] = True
+  return(points[keep])
+
+
+# Snaps a ring to the coordinate grid and simplifies it. None if it collapses to less than a triangle.
+def simplify_ring(ring, tolerance, decimals):
+  points = np.round(np.asarray(ring, dtype=float), decimals)
+  points = points[np.r_[True, np.any(points[1:] != points[:-1], axis=1)]]
+  points = simplify_line(points, tolerance)
+  if len(points) < 4:
+    return(None)
+  return(points.tolist())
+
+
+def simplify_polygon(polygon, tolerance, decimals):
+  rings = [simplify_ring(ring, tolerance, decimals) for ring in polygon]
+  if rings[0] is None:
+    return(None)
+  return([ring for ring in rings if ring is not None])
+
+
+def simplify_geometry(geo, level):
+  tolerance, decimals, min_zoom = GEOMETRY_LEVELS[level]
+  features = []
+  for feature in geo["features"]:
+    geometry = feature["geometry"]
+    if geometry["type"] == "Polygon":
+      polygons = [geometry["coordinates"]]
+    else:
+      polygons = geometry["coordinates"]
+    simplified = [p for p in (simplify_polygon(p, tolerance, decimals) for p in polygons) if p is not None]
+    if not simplified:
+      # Small countries keep their outline with only the coordinates rounded
+      simplified = [simplify_polygon(polygons[0], 0, decimals) or polygons[0]]
+    features.append({
+      "type": "Feature", "id": feature["id"], "properties": feature["properties"],
+      "geometry": {"type": "MultiPolygon", "coordinates": simplified}
+    })
+  return({"type": "FeatureCollection", "features": features})
+
+
+# One detail level of the map geometry, simplified on the fly if ingest.py has not written it
+@versioned()
+def load_geometry(level):
+  path = geometry_file(level)
+  if os.path.exists(path):
+    with open(path) as f:
+      return(json.load(f))
+  from countries import country_geo
+  return(simplify_geometry(country_geo(), level))
+
+
+# How a map layer gets its geometry: the addresses of all the detail levels, or one level embedded
+def geometry_source():
+  if GEOMETRY_URL:
+    return({"geometry_urls": {level: GEOMETRY_URL.format(level=level) for level in GEOMETRY_LEVELS},
+            "detail_zoom": {level: GEOMETRY_LEVELS[level][2] for level in GEOMETRY_LEVELS}})
+  return({"geometry": load_geometry(EMBEDDED_LEVEL)})
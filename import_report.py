@@ -0,0 +1,55 @@
+# Import-time report for the app modules, made with `python -X importtime`.
+# Run `python import_report.py [budget in ms]`. Exits with status 1 if importing the app modules takes longer than the budget
+# or if one of the LAZY_MODULES gets imported with them, so it can be used as a check before deploying.
+import subprocess
+import sys
+
+APP_MODULES = ["util", "plots", "forecasts", "countries", "geometry", "sectors"]
+# Heavy libraries that only the code using them should import
+LAZY_MODULES = ["folium", "branca", "plotly", "statsmodels", "scipy", "sklearn", "streamlit_folium", "openpyxl"]
+DEFAULT_BUDGET_MS = 2000
+RUNS = 3
+
+
+# {module: (depth, self ms, cumulative ms)} of everything imported by `import modules`
+def import_times(modules):
+  code = "import " + ", ".join(modules) if modules else "pass"
+  output = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, check=True).stderr
+  times = {}
+  for line in output.splitlines():
+    if not line.startswith("import time:") or line.endswith("imported package"):
+      continue
+    self_us, cumulative_us, name = line[len("import time:"):].split("|")
+    depth = (len(name) - len(name.lstrip()) - 1) // 2
+    times[name.strip()] = (depth, int(self_us) / 1000, int(cumulative_us) / 1000)
+  return(times)
+
+
+def report(budget_ms=DEFAULT_BUDGET_MS, top=10):
+  # Modules the interpreter imports at startup are not counted
+  startup = import_times([])
+  # The fastest of a few runs, the first one also compiles the modules
+  runs = [{m: t for m, t in import_times(APP_MODULES).items() if m not in startup} for _ in range(RUNS)]
+  times = min(runs, key=lambda t: sum(c for d, s, c in t.values() if d == 0))
+  total = sum(cumulative for depth, self_ms, cumulative in times.values() if depth == 0)
+
+  print("Importing", ", ".join(APP_MODULES), "takes %.0f ms (budget %.0f ms)" % (total, budget_ms))
+  # Time of each package, from the module where it was first imported
+  packages = {}
+  for module, (depth, self_ms, cumulative) in times.items():
+    package = module.split(".")[0]
+    packages[package] = max(packages.get(package, 0), cumulative)
+  print("\nSlowest packages:")
+  for package, cumulative in sorted(packages.items(), key=lambda p: -p[1])[:top]:
+    print("  %8.1f ms  %s" % (cumulative, package))
+
+  eager = [module for module in LAZY_MODULES if module in times]
+  if eager:
+    print("\nImported although they should be lazy:", ", ".join(eager))
+  return(total <= budget_ms and not eager)
+
+
+if __name__ == "__main__":
+  budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+  sys.exit(0 if report(budget) else 1)
@@ -0,0 +1,76 @@
+# One-time ingest step: converts the raw data files into the binary snapshots the app reads.
+# Run `python ingest.py` to build them from scratch, refresh.py updates them to a new OWID csv.
+import pandas as pd
+import json
+
+from util import OWID_CSV, OWID_SNAPSHOT
+from countries import GEO_FILE, COUNTRY_INDEX, build_country_index, unmatched_countries, add_country_ids
+from geometry import GEOMETRY_DIR, GEOMETRY_LEVELS, geometry_file, simplify_geometry
+from forecasts import FORECAST_FILE, build_forecast_table
+from sectors import SECTOR_CUBE, build_sector_cube
+import os
+
+
+# OWID csv with the column types of the snapshot
+def read_OWID_csv(csv_path=OWID_CSV):
+  df = pd.read_csv(csv_path)
+  df["iso_code"] = df["iso_code"].astype("category")
+  df["year"] = df["year"].astype("int32")
+  return(df)
+
+
+# OWID csv -> typed parquet file, so the app can read single columns without parsing the whole csv
+def build_OWID_snapshot(csv_path=OWID_CSV, snapshot_path=OWID_SNAPSHOT):
+  read_OWID_csv(csv_path).to_parquet(snapshot_path, index=False)
+  return(snapshot_path)
+
+
+# OWID entities joined to the map features, see countries.build_country_index
+def build_country_index_file(snapshot_path=OWID_SNAPSHOT, geo_path=GEO_FILE, index_path=COUNTRY_INDEX):
+  owid = pd.read_parquet(snapshot_path, columns=["country", "iso_code"])
+  with open(geo_path) as f:
+    geo = json.load(f)
+  index = build_country_index(owid, geo)
+  index.to_parquet(index_path, index=False)
+  return(index, unmatched_countries(index, geo))
+
+
+# Simplified and quantized map geometry for every detail level, see geometry.py
+def build_geometry_files(index_path=COUNTRY_INDEX, geo_path=GEO_FILE):
+  with open(geo_path) as f:
+    geo = add_country_ids(json.load(f), pd.read_parquet(index_path))
+  os.makedirs(GEOMETRY_DIR, exist_ok=True)
+  sizes = {}
+  for level in GEOMETRY_LEVELS:
+    with open(geometry_file(level), "w") as f:
+      json.dump(simplify_geometry(geo, level), f, separators=(",", ":"))
+    sizes[level] = os.path.getsize(geometry_file(level))
+  return(sizes)
+
+
+# Forecasts of every country, see forecasts.py. Needs the OWID snapshot.
+def build_forecast_file(forecast_path=FORECAST_FILE):
+  table = build_forecast_table()
+  table.to_parquet(forecast_path, index=False)
+  return(table)
+
+
+# The sector files in res/ in one table, see sectors.py
+def build_sector_cube_file(cube_path=SECTOR_CUBE):
+  cube = build_sector_cube()
+  cube.to_parquet(cube_path, index=False)
+  return(cube)
+
+
+if __name__ == "__main__":
+  print("OWID snapshot written to", build_OWID_snapshot())
+  index, (unmatched_owid, unmatched_geo) = build_country_index_file()
+  print("Country index written to", COUNTRY_INDEX, "-", len(index), "entities,", int(index.is_aggregate.sum()), "aggregates")
+  print("OWID countries not on the map:", ", ".join(unmatched_owid))
+  print("Map features without OWID data:", ", ".join(unmatched_geo))
+  for level, size in build_geometry_files().items():
+    print("Map geometry", geometry_file(level), "-", size // 1024, "KB")
+  table = build_forecast_file()
+  print("Forecasts written to", FORECAST_FILE, "-", table.country.nunique(), "countries")
+  cube = build_sector_cube_file()
+  print("Sector cube written to", SECTOR_CUBE, "-", len(cube), "rows,", cube.entity.nunique(), "entities")
@@ -0,0 +1,160 @@
+import functools
+import contextlib
+import threading
+import time
+import os
+import sys
+
+# Opt-in timing of the cached functions and the page sections: run with APP_METRICS=1.
+# The numbers are written to METRICS_FILE after every rerun and shown on the diagnostics page (world_map.py?diagnostics=1).
+ENABLED = os.environ.get("APP_METRICS", "") not in ("", "0")
+METRICS_FILE = os.environ.get("APP_METRICS_FILE", "metrics.txt")
+
+_lock = threading.Lock()
+_stats = {}
+_reruns = {}
+
+
+# Resident memory of the process in MB
+def rss_mb():
+  try:
+    with open("/proc/self/statm") as f:
+      return(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20)
+  except (OSError, ValueError):
+    import resource
+    return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+# Resident memory, size of the shared data cache and number of sessions at the end of the first complete run, empty until then.
+# The libraries the page imports (plotly, folium, pyarrow) and the data it loaded are in it, so what the resident memory grows by
+# after it comes from the sessions that connect later and the data they load
+BASELINE = {}
+
+# Number of browser sessions connected to the server, None outside of streamlit
+def session_count():
+  try:
+    from streamlit.server.server import Server
+    return(len(Server.get_current()._session_info_by_id))
+  except (ImportError, AttributeError, RuntimeError):
+    return(None)
+
+
+# seconds: time of the call, compute_s: time spent computing (None for a cache hit), memory_mb: change of resident memory
+def record(kind, name, seconds, compute_s=None, memory_mb=0.0):
+  with _lock:
+    if name not in _stats:
+      _stats[name] = {"kind": kind, "calls": 0, "time_s": 0.0, "max_time_s": 0.0, "last_time_s": 0.0, "memory_mb": 0.0}
+      if kind == "function":
+        _stats[name].update({"hits": 0, "misses": 0, "compute_s": 0.0, "overhead_s": 0.0})
+    stats = _stats[name]
+    stats["calls"] += 1
+    stats["time_s"] += seconds
+    stats["max_time_s"] = max(stats["max_time_s"], seconds)
+    stats["last_time_s"] = seconds
+    stats["memory_mb"] += memory_mb
+    if kind == "function":
+      if compute_s is None:
+        stats["hits"] += 1
+        stats["overhead_s"] += seconds
+      else:
+        stats["misses"] += 1
+        stats["compute_s"] += compute_s
+        # Hashing the arguments and the output, and the cache lookup
+        stats["overhead_s"] += max(seconds - compute_s, 0.0)
+
+
+# JSON size of a figure before and after payload.slimmed made it smaller, and the time that took
+def record_payload(name, full_bytes, bytes, seconds):
+  # Next to the timings of the function itself
+  name += ".payload"
+  with _lock:
+    if name not in _stats:
+      _stats[name] = {"kind": "payload", "calls": 0, "time_s": 0.0, "max_time_s": 0.0, "last_time_s": 0.0, "full_bytes": 0, "bytes": 0,
+                      "last_bytes": 0}
+    stats = _stats[name]
+    stats["calls"] += 1
+    stats["time_s"] += seconds
+    stats["max_time_s"] = max(stats["max_time_s"], seconds)
+    stats["last_time_s"] = seconds
+    stats["full_bytes"] += full_bytes
+    stats["bytes"] += bytes
+    stats["last_bytes"] = bytes
+
+
+# A functools.lru_cache or datacache.versioned function that also records hits, misses and compute time, when ENABLED.
+# The outcome of a call is read from its cache_info
+def instrument_lru(func):
+  if not ENABLED:
+    return(func)
+
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    misses = func.cache_info().misses
+    memory = rss_mb()
+    start = time.perf_counter()
+    try:
+      return(func(*args, **kwargs))
+    finally:
+      seconds = time.perf_counter() - start
+      computed = func.cache_info().misses > misses
+      record("function", func.__module__ + "." + func.__qualname__, seconds, seconds if computed else None, rss_mb() - memory)
+  wrapper.cache_info = func.cache_info
+  wrapper.cache_clear = func.cache_clear
+  return(wrapper)
+
+
+# Times a part of the page: with section("map"): ...
+@contextlib.contextmanager
+def section(name):
+  if not ENABLED:
+    yield
+    return
+  memory = rss_mb()
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    record("section", name, time.perf_counter() - start, memory_mb=rss_mb() - memory)
+
+
+# Called at the start and at the end of world_map.py, times the whole rerun and writes the metrics file
+def begin_rerun():
+  if ENABLED:
+    _reruns[threading.get_ident()] = (time.perf_counter(), rss_mb())
+
+def end_rerun():
+  if not BASELINE:
+    # The data cache of the process, the page does not import it when it gets the data from the API
+    datacache = sys.modules.get("datacache")
+    BASELINE.update(resident_mb=rss_mb(), shared_mb=datacache.cache_size()[1] if datacache else 0.0, sessions=session_count() or 1)
+  if not ENABLED or threading.get_ident() not in _reruns:
+    return
+  start, memory = _reruns.pop(threading.get_ident())
+  record("rerun", "rerun", time.perf_counter() - start, memory_mb=rss_mb() - memory)
+  write_metrics()
+
+
+def metrics_table():
+  import pandas as pd
+  with _lock:
+    return(pd.DataFrame.from_dict(_stats, orient="index").rename_axis("name").reset_index())
+
+
+# The metrics in the Prometheus text format
+def metrics_text():
+  lines = ["app_resident_memory_mb %.1f" % rss_mb()]
+  with _lock:
+    for name, stats in sorted(_stats.items()):
+      labels = '{name="%s",kind="%s"}' % (name, stats["kind"])
+      for key, value in stats.items():
+        if key != "kind":
+          lines.append("app_%s%s %s" % (key, labels, round(value, 6)))
+  return("\n".join(lines) + "\n")
+
+
+def write_metrics(path=METRICS_FILE):
+  # Written to a temporary file first, so that readers never see half a file
+  tmp = "%s.%d.tmp" % (path, threading.get_ident())
+  with open(tmp, "w") as f:
+    f.write(metrics_text())
+  os.replace(tmp, path)
@@ -0,0 +1,337 @@
+# Load test of the app: simulated sessions run scripted interactions through world_map.py on a real streamlit server, without a browser.
+# A session talks to the server's websocket like the browser does: it sends the values of the widgets, the server reruns the script,
+# and the session reads what the rerun sends until it has finished.
+#   python loadtest.py --sessions 20 --save benchmarks/load-before.json
+#   python loadtest.py --sessions 20 --compare benchmarks/load-before.json
+#   MAP_MODE=server python loadtest.py --sessions 10 --scenarios map-years --think 1
+# The server is started with APP_METRICS=1 and an empty figure store, so every run starts from the same state and runs of different
+# commits can be compared. Reports the rerun latency percentiles of every interaction, the throughput, the memory the sessions add to the
+# server and the hits and misses of the cached functions during the load (from the metrics file of instrumentation.py).
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+import tornado.websocket
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+from benchmark import REPO_DIR, git_commit
+
+PORT = 8701
+# Seconds to wait for the server to start and for a rerun to finish
+START_TIMEOUT = 120
+RERUN_TIMEOUT = 300
+# Elements the sessions interact with
+WIDGETS = ("radio", "selectbox", "slider", "button")
+
+# Interactions of a session: ("open",) loads the page, ("choose", label) picks another option of a select box or radio,
+# ("slide", label, key) moves a slider to a random value, ("press", label) presses a button and ("page", name) goes to a page.
+# key is the key the slider has in world_map.py, "None" without one: the map and the changes plot both have a "Year" slider.
+SCENARIOS = {
+  "countries": [("open",)] + [("choose", "Select region")] * 6,
+  "changes-years": [("open",)] + [("slide", "Year", "1")] * 6 + [("press", "animate")],
+  # The map year is a streamlit widget only with MAP_MODE=server. With the slider map it is picked in the browser and these are skipped
+  "map-years": [("open",)] + [("slide", "Year", "None")] * 6,
+  "pages": [("open",), ("page", "About"), ("page", "Home"), ("page", "About"), ("page", "Home")],
+  "mixed": [("open",), ("choose", "Select region"), ("slide", "Year", "1"), ("press", "animate"), ("slide", "Year", "None"),
+            ("page", "About"), ("page", "Home"), ("choose", "Select region")]
+}
+
+
+class Session:
+
+  def __init__(self, url, seed):
+    self.url = url
+    self.rng = random.Random(seed)
+    # id -> (type, proto) of the widgets on the page after the last rerun
+    self.widgets = {}
+    # id -> (field of WidgetState, value) of the widgets that were changed, sent with every rerun like the browser does
+    self.states = {}
+    self.ws = None
+
+  async def connect(self):
+    self.ws = await tornado.websocket.websocket_connect(self.url, max_message_size=2**30)
+
+  def close(self):
+    if self.ws is not None:
+      self.ws.close()
+
+  def find(self, label, key=None):
+    for id, (kind, widget) in self.widgets.items():
+      if widget.label == label and (key is None or id.endswith("-" + key)):
+        return(id, widget)
+    return(None)
+
+  # The widget states the browser would send for the step, None when its widget is not on the page
+  def step_states(self, step):
+    states = dict(self.states)
+    if step[0] == "open":
+      return(states)
+    found = self.find("Pages") if step[0] == "page" else self.find(*step[1:])
+    if found is None:
+      return(None)
+    id, widget = found
+    if step[0] == "page":
+      if step[1] not in widget.options:
+        return(None)
+      states[id] = ("int_value", list(widget.options).index(step[1]))
+    elif step[0] == "choose":
+      current = states.get(id, ("int_value", widget.default))[1]
+      states[id] = ("int_value", self.rng.choice([i for i in range(len(widget.options)) if i != current]))
+    elif step[0] == "slide":
+      states[id] = ("double_array_value", [self.rng.randint(int(widget.min), int(widget.max))])
+    elif step[0] == "press":
+      states[id] = ("trigger_value", True)
+    return(states)
+
+  # Reruns the script with the widget states. Returns the seconds until the rerun finished, the bytes received and the number of
+  # exceptions shown on the page
+  async def rerun(self, states, timeout=RERUN_TIMEOUT):
+    msg = BackMsg()
+    msg.rerun_script.query_string = ""
+    for id, (field, value) in states.items():
+      state = msg.rerun_script.widget_states.widgets.add()
+      state.id = id
+      if field == "double_array_value":
+        state.double_array_value.data.extend(value)
+      else:
+        setattr(state, field, value)
+    start = time.perf_counter()
+    await self.ws.write_message(msg.SerializeToString(), binary=True)
+    widgets, received, errors = {}, 0, 0
+    while True:
+      data = await asyncio.wait_for(self.ws.read_message(), timeout)
+      if data is None:
+        raise ConnectionError("the server closed the connection")
+      received += len(data)
+      forward = ForwardMsg()
+      forward.ParseFromString(data)
+      if forward.WhichOneof("type") == "report_finished":
+        break
+      if forward.WhichOneof("type") == "delta" and forward.delta.WhichOneof("type") == "new_element":
+        kind = forward.delta.new_element.WhichOneof("type")
+        if kind == "exception":
+          errors += 1
+        elif kind in WIDGETS:
+          element = getattr(forward.delta.new_element, kind)
+          widgets[element.id] = (kind, element)
+    seconds = time.perf_counter() - start
+    self.widgets = widgets
+    # A button is pressed for one rerun only, and the browser forgets the widgets that are not on the page any more
+    self.states = {id: state for id, state in states.items() if id in widgets and state[0] != "trigger_value"}
+    return(seconds, received, errors)
+
+
+# Runs the scenario repeat times, appending a row per step to results. Returns the session, still connected
+async def run_session(number, url, scenario, repeat, think, seed, delay, results):
+  await asyncio.sleep(delay)
+  session = Session(url, seed + number)
+  row = {"session": number, "scenario": scenario}
+  try:
+    await session.connect()
+    for _ in range(repeat):
+      for step in SCENARIOS[scenario]:
+        name = " ".join(step)
+        states = session.step_states(step)
+        if states is None:
+          results.append(dict(row, step=name, skipped=True))
+          continue
+        seconds, received, errors = await session.rerun(states)
+        results.append(dict(row, step=name, seconds=seconds, bytes=received, errors=errors))
+        if think:
+          await asyncio.sleep(session.rng.uniform(0, 2 * think))
+  except Exception as e:
+    results.append(dict(row, step="failed", failed=repr(e)))
+  return(session)
+
+
+# Resident memory of a process in MB, None when it cannot be read
+def process_rss_mb(pid):
+  try:
+    with open("/proc/%d/statm" % pid) as f:
+      return(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20)
+  except (OSError, ValueError, TypeError):
+    return(None)
+
+# name -> {statistic: value} from a metrics file written by instrumentation.py
+def read_metrics(path):
+  metrics = {}
+  try:
+    with open(path) as f:
+      lines = f.read().splitlines()
+  except (OSError, TypeError):
+    return(metrics)
+  for line in lines:
+    if "{" not in line:
+      continue
+    key, value = line.rsplit(" ", 1)
+    statistic, labels = key[len("app_"):].split("{", 1)
+    name = labels.split('name="', 1)[1].split('",kind="', 1)[0]
+    metrics.setdefault(name, {"kind": labels.rsplit('kind="', 1)[1].rstrip('"}')})[statistic] = float(value)
+  return(metrics)
+
+
+# Starts world_map.py on a headless streamlit server and waits until it answers
+def start_server(port, folder):
+  env = dict(os.environ, APP_METRICS="1", APP_METRICS_FILE=os.path.join(folder, "metrics.txt"),
+             FIGURE_STORE_DIR=os.path.join(folder, "figure-store"))
+  log = open(os.path.join(folder, "server.log"), "w")
+  server = subprocess.Popen([sys.executable, "-m", "streamlit", "run", "world_map.py", "--server.headless", "true",
+                             "--server.port", str(port), "--server.runOnSave", "false", "--browser.gatherUsageStats", "false"],
+                            cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+  deadline = time.time() + START_TIMEOUT
+  while time.time() < deadline and server.poll() is None:
+    try:
+      with urllib.request.urlopen("http://localhost:%d/healthz" % port, timeout=1):
+        return(server)
+    except OSError:
+      time.sleep(0.5)
+  server.kill()
+  with open(log.name) as f:
+    sys.exit("The streamlit server did not start:\n" + f.read()[-3000:])
+
+
+def percentiles(values):
+  p50, p95, p99 = np.percentile(values, [50, 95, 99])
+  return({"count": len(values), "p50_s": p50, "p95_s": p95, "p99_s": p99, "mean_s": float(np.mean(values))})
+
+# Hits and misses of the cached functions between two read_metrics
+def cache_report(before, after):
+  functions = {}
+  for name, stats in after.items():
+    if stats["kind"] != "function":
+      continue
+    old = before.get(name, {})
+    hits, misses = stats["hits"] - old.get("hits", 0), stats["misses"] - old.get("misses", 0)
+    if hits or misses:
+      functions[name] = {"hits": int(hits), "misses": int(misses), "compute_s": stats["compute_s"] - old.get("compute_s", 0)}
+  hits, misses = sum(f["hits"] for f in functions.values()), sum(f["misses"] for f in functions.values())
+  return({"hits": hits, "misses": misses, "hit_ratio": hits / (hits + misses) if hits + misses else None, "functions": functions})
+
+
+async def load_test(args, url, pid, metrics_file):
+  # The first page load reads the data and fills the shared caches, the sessions are measured after it
+  first = Session(url, args.seed)
+  await first.connect()
+  cold_start_s, cold_bytes, cold_errors = await first.rerun({})
+  first.close()
+  baseline_mb = process_rss_mb(pid)
+  before = read_metrics(metrics_file)
+
+  results = []
+  start = time.perf_counter()
+  sessions = await asyncio.gather(*[
+    run_session(i, url, args.scenarios[i % len(args.scenarios)], args.repeat, args.think, args.seed, i * args.ramp / args.sessions, results)
+    for i in range(args.sessions)])
+  elapsed = time.perf_counter() - start
+  # Measured while every session is still connected
+  loaded_mb = process_rss_mb(pid)
+  after = read_metrics(metrics_file)
+  for session in sessions:
+    session.close()
+
+  reruns = [r for r in results if "seconds" in r]
+  latency = {"all": percentiles([r["seconds"] for r in reruns])} if reruns else {}
+  for step in sorted(set(r["step"] for r in reruns)):
+    rows = [r for r in reruns if r["step"] == step]
+    latency[step] = dict(percentiles([r["seconds"] for r in rows]), kb=sum(r["bytes"] for r in rows) / len(rows) / 1024)
+  return({
+    "commit": git_commit(), "map_mode": os.environ.get("MAP_MODE", "slider"), "sessions": args.sessions, "scenarios": args.scenarios,
+    "repeat": args.repeat, "think_s": args.think, "ramp_s": args.ramp, "seed": args.seed,
+    "cold_start_s": cold_start_s, "cold_start_kb": cold_bytes / 1024, "elapsed_s": elapsed, "reruns": len(reruns),
+    "throughput_per_s": len(reruns) / elapsed, "errors": cold_errors + sum(r["errors"] for r in reruns),
+    "skipped": sum(1 for r in results if r.get("skipped")), "failed": [r["failed"] for r in results if "failed" in r],
+    "latency": latency,
+    "memory": {"baseline_mb": baseline_mb, "loaded_mb": loaded_mb,
+               "per_session_mb": (loaded_mb - baseline_mb) / args.sessions if baseline_mb is not None and loaded_mb is not None else None},
+    "cache": cache_report(before, after) if metrics_file else None
+  })
+
+
+def print_report(report):
+  print("Cold start %.2f s (%.0f KB), %d sessions (%s), %d reruns in %.1f s: %.1f reruns/s, %d exceptions on the page, %d steps skipped" %
+        (report["cold_start_s"], report["cold_start_kb"], report["sessions"], ", ".join(report["scenarios"]), report["reruns"],
+         report["elapsed_s"], report["throughput_per_s"], report["errors"], report["skipped"]))
+  for failure in report["failed"]:
+    print("Session failed:", failure)
+  print("\n%-28s %6s %9s %9s %9s %9s" % ("rerun latency", "count", "p50 ms", "p95 ms", "p99 ms", "KB"))
+  for step, stats in report["latency"].items():
+    print("%-28s %6d %9.1f %9.1f %9.1f %9s" % (step, stats["count"], 1000 * stats["p50_s"], 1000 * stats["p95_s"], 1000 * stats["p99_s"],
+                                              "%.1f" % stats["kb"] if "kb" in stats else ""))
+  memory = report["memory"]
+  if memory["per_session_mb"] is not None:
+    # The values the sessions added to the shared caches are part of it
+    print("\nServer memory %.0f MB after the first page load, %.0f MB with the sessions connected: %.2f MB per session" %
+          (memory["baseline_mb"], memory["loaded_mb"], memory["per_session_mb"]))
+  cache = report["cache"]
+  if cache and cache["hit_ratio"] is not None:
+    print("\nCached functions during the load: %d hits, %d misses (%.1f%% hits)" % (cache["hits"], cache["misses"], 100 * cache["hit_ratio"]))
+    for name, stats in sorted(cache["functions"].items(), key=lambda item: -item[1]["compute_s"]):
+      if stats["misses"]:
+        print("  %-40s %6d hits %6d misses %8.2f s computing" % (name, stats["hits"], stats["misses"], stats["compute_s"]))
+
+
+def compare(report, baseline):
+  print("\n%-28s %10s %10s %10s" % ("compared to " + baseline["commit"][:10], "p50", "p95", "p99"))
+  for step, stats in report["latency"].items():
+    if step not in baseline["latency"]:
+      continue
+    before = baseline["latency"][step]
+    ratios = [stats[key] / before[key] if before[key] else float("nan") for key in ["p50_s", "p95_s", "p99_s"]]
+    print("%-28s %9.2fx %9.2fx %9.2fx" % (step, *ratios))
+  print("%-28s %9.2fx" % ("throughput", report["throughput_per_s"] / baseline["throughput_per_s"]))
+  if report["memory"]["per_session_mb"] is not None and baseline["memory"]["per_session_mb"]:
+    print("%-28s %9.2fx" % ("memory per session", report["memory"]["per_session_mb"] / baseline["memory"]["per_session_mb"]))
+  if (baseline["sessions"], baseline["scenarios"], baseline["repeat"], baseline["think_s"], baseline["map_mode"]) != \
+     (report["sessions"], report["scenarios"], report["repeat"], report["think_s"], report["map_mode"]):
+    print("The baseline was run with other sessions, scenarios, repeat, think time or MAP_MODE")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Load test the app with simulated sessions")
+  parser.add_argument("--sessions", type=int, default=10, help="number of concurrent sessions")
+  parser.add_argument("--scenarios", nargs="*", choices=list(SCENARIOS), default=list(SCENARIOS),
+                      help="scenarios of the sessions, given to them in turn")
+  parser.add_argument("--repeat", type=int, default=1, help="times every session runs its scenario")
+  parser.add_argument("--think", type=float, default=0.0, help="mean seconds a session waits between interactions")
+  parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which the sessions are started")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--port", type=int, default=PORT)
+  parser.add_argument("--url", help="load test a running server instead (e.g. ws://localhost:8501/stream), without memory and cache numbers")
+  parser.add_argument("--save", help="write the results to this json file")
+  parser.add_argument("--compare", help="compare the results to a json file written with --save")
+  args = parser.parse_args()
+
+  save = os.path.abspath(args.save) if args.save else None
+  server, folder, metrics_file = None, None, None
+  url = args.url
+  if not url:
+    folder = tempfile.mkdtemp(prefix="loadtest-")
+    server = start_server(args.port, folder)
+    url = "ws://localhost:%d/stream" % args.port
+    metrics_file = os.path.join(folder, "metrics.txt")
+  try:
+    report = asyncio.run(load_test(args, url, server.pid if server else None, metrics_file))
+  finally:
+    if server:
+      server.terminate()
+      server.wait()
+      shutil.rmtree(folder)
+
+  print_report(report)
+  if args.compare:
+    with open(args.compare) as f:
+      compare(report, json.load(f))
+  if save:
+    os.makedirs(os.path.dirname(save), exist_ok=True)
+    with open(save, "w") as f:
+      json.dump(report, f, indent=2)
@@ -0,0 +1,173 @@
+import numpy as np
+from jinja2 import Template
+from folium.map import Layer
+from branca.colormap import StepColormap
+from branca.utilities import color_brewer
+
+
+# The bin of every value when they are split into bins (a number of equal width bins or the bin edges) like folium.Choropleth does.
+# Returns the bin edges and the bin of every value, -1 for missing values
+def step_bins(values, bins):
+  values = np.asarray(values, dtype=float)
+  real_values = values[~np.isnan(values)]
+  if isinstance(bins, int):
+    _, bin_edges = np.histogram(real_values, bins=bins)
+  else:
+    bin_edges = np.asarray(bins, dtype=float)
+  # The last bin includes its right edge
+  edges = bin_edges.copy()
+  edges[-1] = np.nextafter(edges[-1], np.inf)
+  color_idx = np.clip(np.digitize(values, edges, right=False) - 1, 0, len(bin_edges) - 2)
+  return(bin_edges, np.where(np.isnan(values), -1, color_idx))
+
+
+# Color of every value, see step_bins. Returns the colors (None for missing values) and the legend.
+def step_colors(values, fill_color, bins, legend_name):
+  bin_edges, color_idx = step_bins(values, bins)
+  color_range = color_brewer(fill_color, n=len(bin_edges) - 1)
+  color_scale = StepColormap(color_range, index=list(bin_edges), vmin=bin_edges[0], vmax=bin_edges[-1], caption=legend_name)
+  colors = [None if i < 0 else color_range[i] for i in color_idx]
+  return(colors, color_scale)
+
+
+# Choropleth that only carries a {country_id: color} table. The country shapes are either embedded once (geometry)
+# or loaded by the browser from geometry_urls ({detail level: url}, the level picked by the zoom from detail_zoom),
+# so they can be cached by the browser and are not part of every map that is sent.
+class ValueChoropleth(Layer):
+  _colors_template = Template("""var {{ this.get_name() }}_colors = {{ this.colors|tojson }};""")
+  _template = Template("""
+    {% macro script(this, kwargs) %}
+    {{ this.colors_script() }}
+    var {{ this.get_name() }} = L.geoJson(null, {
+      style: function(feature) {
+        var color = {{ this.get_name() }}_colors[feature.properties.country_id];
+        return {
+          fillColor: color || {{ this.nan_fill_color|tojson }}, fillOpacity: {{ this.fill_opacity }},
+          color: "black", weight: 1, opacity: {{ this.line_opacity }}
+        };
+      },
+      onEachFeature: function(feature, layer) {
+        layer.bindTooltip("<b>name</b> " + feature.properties.name, {sticky: true});
+      }
+    });
+    {%- if this.geometry_urls %}
+    var {{ this.get_name() }}_levels = {};
+    function {{ this.get_name() }}_load() {
+      var zoom = {{ this._parent.get_name() }}.getZoom();
+      var detail_zoom = {{ this.detail_zoom|tojson }};
+      var level = null;
+      for (var l in detail_zoom) {
+        if (detail_zoom[l] <= zoom && (level === null || detail_zoom[l] > detail_zoom[level])) { level = l; }
+      }
+      if ({{ this.get_name() }}.level === level) { return; }
+      {{ this.get_name() }}.level = level;
+      if (!{{ this.get_name() }}_levels[level]) {
+        {{ this.get_name() }}_levels[level] = fetch({{ this.geometry_urls|tojson }}[level]).then(function(response) { return response.json(); });
+      }
+      {{ this.get_name() }}_levels[level].then(function(geometry) {
+        if ({{ this.get_name() }}.level !== level) { return; }
+        {{ this.get_name() }}.clearLayers();
+        {{ this.get_name() }}.addData(geometry);
+      });
+    }
+    {{ this._parent.get_name() }}.on("zoomend", {{ this.get_name() }}_load);
+    {{ this.get_name() }}_load();
+    {%- else %}
+    {{ this.get_name() }}.addData({{ this.geometry|tojson }});
+    {%- endif %}
+    {% endmacro %}
+    """)
+
+  def __init__(self, colors, color_scale=None, geometry=None, geometry_urls=None, detail_zoom=None,
+               name=None, nan_fill_color="white", fill_opacity=0.7, line_opacity=0.2):
+    super().__init__(name=name, overlay=True)
+    self._name = "ValueChoropleth"
+    self.colors = colors
+    self.geometry = geometry
+    self.geometry_urls = geometry_urls
+    self.detail_zoom = detail_zoom
+    self.nan_fill_color = nan_fill_color
+    self.fill_opacity = fill_opacity
+    self.line_opacity = line_opacity
+    self.color_scale = color_scale
+    if color_scale is not None:
+      self.add_child(color_scale)
+
+  # The script defining the {country_id: color} table the style reads
+  def colors_script(self):
+    return(self._colors_template.render(this=self))
+
+  def render(self, **kwargs):
+    # The legend has to be a child of the map
+    if self.color_scale is not None:
+      self.color_scale._parent = self._parent
+    super().render(**kwargs)
+
+
+# ValueChoropleth of several metrics over several years, switched in the browser with a metric list and a year slider on the map.
+# table: {metric: {"name", "legend", "palette": [colors], "years": {year: {"bins": [bin edges], "colors": codes}}}}, where codes has
+# a character per country id: the index of its color in the palette, "." for no data. The map is sent once and is not redrawn by the server.
+class TimeSliderChoropleth(ValueChoropleth):
+  _colors_template = Template("""
+    var {{ this.get_name() }}_table = {{ this.table|tojson }};
+    var {{ this.get_name() }}_state = {metric: {{ this.metric|tojson }}, year: {{ this.year|tojson }}};
+    var {{ this.get_name() }}_colors = {};
+    var {{ this.get_name() }}_years = Object.keys({{ this.get_name() }}_table[{{ this.get_name() }}_state.metric].years).map(Number);
+
+    var {{ this.get_name() }}_legend = L.control({position: "bottomright"});
+    {{ this.get_name() }}_legend.onAdd = function() {
+      return L.DomUtil.create("div", "info legend");
+    };
+    {{ this.get_name() }}_legend.addTo({{ this._parent.get_name() }});
+    var {{ this.get_name() }}_control = L.control({position: "bottomleft"});
+    {{ this.get_name() }}_control.onAdd = function() {
+      var div = L.DomUtil.create("div", "info");
+      div.style.background = "white";
+      div.style.padding = "6px";
+      var options = "";
+      for (var metric in {{ this.get_name() }}_table) {
+        options += '<option value="' + metric + '">' + {{ this.get_name() }}_table[metric].name + '</option>';
+      }
+      div.innerHTML = '<select>' + options + '</select> <b></b><br><input type="range" style="width: 300px" min="' +
+        Math.min.apply(null, {{ this.get_name() }}_years) + '" max="' + Math.max.apply(null, {{ this.get_name() }}_years) + '" step="1">';
+      var select = div.querySelector("select"), slider = div.querySelector("input");
+      select.value = {{ this.get_name() }}_state.metric;
+      slider.value = {{ this.get_name() }}_state.year;
+      select.onchange = function() { {{ this.get_name() }}_state.metric = select.value; {{ this.get_name() }}_update(); };
+      slider.oninput = function() { {{ this.get_name() }}_state.year = Number(slider.value); {{ this.get_name() }}_update(); };
+      L.DomEvent.disableClickPropagation(div);
+      return div;
+    };
+    {{ this.get_name() }}_control.addTo({{ this._parent.get_name() }});
+
+    function {{ this.get_name() }}_update() {
+      var entry = {{ this.get_name() }}_table[{{ this.get_name() }}_state.metric];
+      var year = entry.years[{{ this.get_name() }}_state.year] || {bins: [], colors: ""};
+      var colors = {};
+      for (var i = 0; i < year.colors.length; i++) {
+        if (year.colors.charAt(i) !== ".") { colors[i] = entry.palette[Number(year.colors.charAt(i))]; }
+      }
+      {{ this.get_name() }}_colors = colors;
+      if (typeof {{ this.get_name() }} !== "undefined" && {{ this.get_name() }}) {
+        {{ this.get_name() }}.eachLayer(function(layer) { {{ this.get_name() }}.resetStyle(layer); });
+      }
+      {{ this.get_name() }}_control.getContainer().querySelector("b").textContent = {{ this.get_name() }}_state.year;
+      var legend = "<b>" + entry.legend + "</b>";
+      for (var i = 0; i + 1 < year.bins.length; i++) {
+        legend += '<br><i style="display: inline-block; width: 12px; height: 12px; background: ' + entry.palette[i] + '"></i> ' +
+          year.bins[i] + " - " + year.bins[i + 1];
+      }
+      var div = {{ this.get_name() }}_legend.getContainer();
+      div.innerHTML = legend;
+      div.style.background = "white";
+      div.style.padding = "6px";
+    }
+    {{ this.get_name() }}_update();
+    """)
+
+  def __init__(self, table, metric, year, **kwargs):
+    super().__init__({}, **kwargs)
+    self._name = "TimeSliderChoropleth"
+    self.table = table
+    self.metric = metric
+    self.year = year
@@ -0,0 +1,163 @@
+import functools
+import time
+import os
+
+import numpy as np
+
+import instrumentation
+
+# Makes the plotly figures smaller before they are cached, stored and sent to the browser:
+#   - line traces longer than MAX_POINTS are downsampled with Largest-Triangle-Three-Buckets, which keeps the peaks and the shape
+#   - the floats are rounded to DIGITS significant digits, and sent as float32 when plotly sends arrays as binary
+#   - the missing values at the ends of a line are dropped and the gaps inside it are kept as a single missing value
+#   - customdata the hover text does not use is not sent
+# The same points are dropped from every per-point array of a trace (hover data, colors, animation ids).
+# FIGURE_SLIM=0 turns it off. With APP_METRICS=1 the JSON size of every figure before and after is recorded (see instrumentation.py).
+ENABLED = os.environ.get("FIGURE_SLIM", "1") not in ("", "0")
+MAX_POINTS = int(os.environ.get("FIGURE_MAX_POINTS", 500))
+DIGITS = int(os.environ.get("FIGURE_DIGITS", 5))
+
+# Trace attributes that have a value per point
+POINT_ARRAYS = ["x", "y", "customdata", "hovertext", "text", "ids", "marker.color", "marker.size"]
+
+
+# Indices of the n points of x, y kept by Largest-Triangle-Three-Buckets. The first and the last point are always kept,
+# from every bucket in between the point making the largest triangle with the point kept before it and the mean of the next bucket
+def lttb(x, y, n):
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  if n >= len(x) or n < 3:
+    return(np.arange(len(x)))
+  edges = np.linspace(1, len(x) - 1, n - 1).astype(int)
+  kept = [0]
+  for i in range(n - 2):
+    start, end = edges[i], edges[i + 1]
+    next_end = edges[i + 2] if i + 2 < len(edges) else len(x)
+    next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+    a = kept[-1]
+    area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+    kept.append(start + int(np.argmax(area)))
+  kept.append(len(x) - 1)
+  return(np.array(kept))
+
+
+# Points of a line to keep: without the missing values at the ends and with one missing value per gap
+def line_points(y):
+  missing = np.isnan(y)
+  keep = ~missing
+  keep[1:] |= missing[1:] & ~missing[:-1]
+  present = np.flatnonzero(~missing)
+  if not len(present):
+    return(present)
+  return(np.flatnonzero(keep[present[0]:present[-1] + 1]) + present[0])
+
+
+# values rounded to digits significant digits
+def round_significant(values, digits):
+  with np.errstate(divide="ignore", invalid="ignore"):
+    exponent = digits - 1 - np.floor(np.log10(np.abs(values)))
+  exponent = np.where(np.isfinite(exponent), exponent, 0)
+  # Dividing by an exact power of ten gives the closest float to the rounded decimal
+  up = 10.0 ** np.maximum(exponent, 0)
+  down = 10.0 ** np.maximum(-exponent, 0)
+  return(np.round(values * up / down) * down / up)
+
+
+# Whether plotly sends numpy arrays as binary typed arrays (plotly 6 and later) instead of JSON numbers
+@functools.lru_cache(maxsize=None)
+def typed_arrays():
+  import plotly.graph_objs as go
+  return('"bdata"' in go.Figure(go.Scatter(y=np.zeros(1))).to_json())
+
+
+def trim(values, digits):
+  if not isinstance(values, np.ndarray) or values.dtype.kind != "f":
+    return(values)
+  values = round_significant(values.astype(float), digits)
+  # A float32 has 7 significant digits, it only makes the JSON numbers longer
+  if digits <= 7 and typed_arrays():
+    values = values.astype("float32")
+  return(values)
+
+
+# None if the trace does not have the attribute
+def get_path(trace, path):
+  for key in path.split("."):
+    if trace is None or key not in trace:
+      return(None)
+    trace = trace[key]
+  return(trace)
+
+def set_path(trace, path, value):
+  for key in path.split(".")[:-1]:
+    trace = trace[key]
+  trace[path.split(".")[-1]] = value
+
+
+# Makes one trace smaller in place
+def slim_trace(trace, max_points, digits):
+  # plotly express adds hover_data=False columns to customdata, they are only sent if the hover text uses them
+  template = get_path(trace, "hovertemplate")
+  if isinstance(template, str) and "customdata" not in template and get_path(trace, "customdata") is not None:
+    trace["customdata"] = None
+  y = trace["y"] if "y" in trace else None
+  if y is not None and not isinstance(y, str) and len(y) and np.asarray(y).dtype.kind in "fi":
+    y = np.asarray(y, dtype=float)
+    arrays = {}
+    for path in POINT_ARRAYS:
+      value = get_path(trace, path)
+      if value is not None and not isinstance(value, str) and np.ndim(value) >= 1 and len(value) == len(y):
+        arrays[path] = np.asarray(value)
+    points = np.arange(len(y))
+    if trace.type in ("scatter", "scattergl") and "lines" in (trace.mode or "lines"):
+      points = line_points(y)
+      x = arrays.get("x")
+      if len(points) > max_points and x is not None and x.dtype.kind in "fi" and np.all(np.diff(x[points]) >= 0) and not np.isnan(y[points]).any():
+        points = points[lttb(x[points], y[points], max_points)]
+    else:
+      points = np.flatnonzero(~np.isnan(y))
+    if len(points) < len(y):
+      for path, value in arrays.items():
+        set_path(trace, path, value[points])
+  for path in POINT_ARRAYS:
+    value = get_path(trace, path)
+    if isinstance(value, np.ndarray):
+      set_path(trace, path, trim(value, digits))
+  if "values" in trace and isinstance(trace["values"], np.ndarray):
+    trace["values"] = trim(trace["values"], digits)
+
+
+# The figure with all its traces, and those of its animation frames, made smaller in place
+def slim_figure(fig, max_points=MAX_POINTS, digits=DIGITS):
+  for trace in fig.data:
+    slim_trace(trace, max_points, digits)
+  for frame in fig.frames:
+    for trace in frame.data:
+      slim_trace(trace, max_points, digits)
+  return(fig)
+
+
+# Size in bytes of the figure as sent to the browser
+def payload_bytes(fig):
+  return(len(fig.to_json(validate=False).encode()))
+
+
+# Decorator making the figure a function returns smaller. Put it under datacache.versioned and figurestore.stored,
+# so the smaller figure is the one kept
+def slimmed(max_points=None, digits=None):
+  def decorator(func):
+    name = func.__module__ + "." + func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      fig = func(*args, **kwargs)
+      if not ENABLED:
+        return(fig)
+      full_bytes = payload_bytes(fig) if instrumentation.ENABLED else None
+      start = time.perf_counter()
+      slim_figure(fig, max_points or MAX_POINTS, digits or DIGITS)
+      if instrumentation.ENABLED:
+        instrumentation.record_payload(name, full_bytes, payload_bytes(fig), time.perf_counter() - start)
+      return(fig)
+    return(wrapper)
+  return(decorator)
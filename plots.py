@@ -1,74 +1,165 @@
-from pandas.core.frame import DataFrame
-import streamlit as st
-from streamlit_folium import folium_static
 import pandas as pd
-import folium
-import plotly.express as px
-import time
-from sklearn.linear_model import LinearRegression
-from folium.plugins import Fullscreen
-import statsmodels.api as smapi
-import statsmodels as sm
-import plotly.graph_objs as go
-from plotly.subplots import make_subplots
+import numpy as np
+import importlib
+import copy
 
-from util import get_OWID_data
+from util import load_data, max_year, owid_index
+from geometry import geometry_source
+from forecasts import forecast_index
+from timeseries import SeriesIndex
+from temperature import temperature_feed
+from sectors import sector_cube, ENERGY, INDUSTRY, WASTE, AFOLU
+import datacache
+from datacache import versioned
+from figurestore import stored
+from payload import slimmed
 
-# Heatmap
-@st.cache(hash_funcs={tuple: lambda x: 1})
-def heatmap(country_geo, df_map, start_year, end_year):
+# folium and plotly take seconds to import, so they are imported in the functions that use them.
+
+TEMPERATURE_FILE = "globalTemperature.csv"
+datacache.watch_file(TEMPERATURE_FILE)
 
-  co2_per_capita_choropleth = {}
-  co2_choropleth = {}
-  co2_growth_choropleth = {}
+# The part of the OWID data each figure is made from (see datacache.scope), so that refresh.py updates keep the figures they do not touch
+def country_scope(country, *args, **kwargs):
+  return(datacache.scope(countries=[country]))
 
-  # Creating all the choropleth maps for all the years
-  # total CO2 emissions and growth percentage are not shown by default, CO2 per capita is
-  for i in range(start_year, end_year+1):
-    df_map_year = df_map[df_map.year == i]
-    co2_pc_bins = list(df_map_year["co2_per_capita"].quantile([0, 0.3, 0.5, 0.6, 0.7, 0.8, 0.9, 0.97, 1]))
-    co2_per_capita_choropleth[i] = folium.Choropleth(geo_data=country_geo, data=df_map_year,
-              columns=['country', 'co2_per_capita'],
-              key_on='feature.properties.name',
-              fill_color='Reds', fill_opacity=0.7, line_opacity=0.2,
-              legend_name='CO2 emissions per capita in tonnes (t)',
-              nan_fill_color="white",
-              bins = co2_pc_bins
-              )
-    co2_per_capita_choropleth[i].geojson.add_child(folium.features.GeoJsonTooltip(fields=['name'], labels=True))
-    co2_per_capita_choropleth[i].layer_name = 'CO2 emissions per capita'
+def map_scope(metric, year):
+  return(datacache.scope(years=(year, year)))
 
-    co2_bins = list(df_map_year["co2"].quantile([0, 0.2, 0.3, 0.5, 0.6, 0.8, 0.97, 1]))
-    co2_choropleth[i] = folium.Choropleth(geo_data=country_geo, data=df_map_year,
-              columns=['country', 'co2'],
-              key_on='feature.properties.name',
-              fill_color='RdPu', fill_opacity=0.7, line_opacity=0.2,
-              legend_name='CO2 emissions in million tonnes (Mt)',
-              nan_fill_color="white",
-              bins = co2_bins
-              )
-    co2_choropleth[i].geojson.add_child(folium.features.GeoJsonTooltip(fields=['name'], labels=True))
-    co2_choropleth[i].layer_name = 'total CO2 emissions'
+def changes_scope(year, rangeX, animate = False):
+  return(datacache.scope(years=(year, None if animate else year)))
 
-    co2_growth_choropleth[i] = folium.Choropleth(geo_data=country_geo, data=df_map_year,
-              columns=['country', 'co2_growth_prct'],
-              key_on='feature.properties.name',
-              fill_color='PuBu', fill_opacity=0.7, line_opacity=0.2,
-              legend_name='CO2 Growth Percentage',
-              nan_fill_color="white"
-              )
-    co2_growth_choropleth[i].geojson.add_child(folium.features.GeoJsonTooltip(fields=['name'], labels=True))
-    co2_growth_choropleth[i].layer_name = 'CO2 growth percentage'
+# Figures not made from the OWID data
+def no_scope():
+  return(datacache.scope(countries=[]))
 
-  return((co2_per_capita_choropleth, co2_choropleth, co2_growth_choropleth))
+# Heatmap
+MAP_START_YEAR = 1950
+# How each map metric is drawn. bins are the quantiles of the year's values used as color bins (None: folium's default bins)
+MAP_LAYERS = {
+  "co2_per_capita": {"fill_color": "Reds", "legend_name": "CO2 emissions per capita in tonnes (t)", "layer_name": "CO2 emissions per capita",
+    "bins": [0, 0.3, 0.5, 0.6, 0.7, 0.8, 0.9, 0.97, 1]},
+  "co2": {"fill_color": "RdPu", "legend_name": "CO2 emissions in million tonnes (Mt)", "layer_name": "total CO2 emissions",
+    "bins": [0, 0.2, 0.3, 0.5, 0.6, 0.8, 0.97, 1]},
+  "co2_growth_prct": {"fill_color": "PuBu", "legend_name": "CO2 Growth Percentage", "layer_name": "CO2 growth percentage",
+    "bins": None}
+}
+# Number of choropleths kept in memory. They share the map geometry, each one only holds its colors.
+MAP_CACHE_SIZE = 24
+
+# The map data (util.load_data) indexed by country and year
+@versioned()
+def map_index():
+  country_geo, df_map = load_data(MAP_START_YEAR, int(max_year()))
+  return(SeriesIndex(df_map))
+
+# Quantile bins of every binned metric for all the years, computed in one grouped pass.
+# Returns a DataFrame indexed by (year, quantile) with a column per metric
+@versioned()
+def heatmap_bins():
+  country_geo, df_map = load_data(MAP_START_YEAR, int(max_year()))
+  metrics = [metric for metric, layer in MAP_LAYERS.items() if layer["bins"] is not None]
+  quantiles = sorted(set(q for metric in metrics for q in MAP_LAYERS[metric]["bins"]))
+  return(df_map.groupby("year")[metrics].quantile(quantiles))
+
+# Colors ({country_id: color}) and legend of one metric in one year, computed the first time that year is viewed.
+# The choropleth itself is built for every render by map_html: a folium element belongs to the map it is added to, a cached one would be
+# moved between the maps rendered at the same time
+@versioned(maxsize=MAP_CACHE_SIZE, scope=map_scope)
+def heatmap(metric, year):
+  from map_layers import step_colors
+  layer = MAP_LAYERS[metric]
+  bins = 6   # folium's default: 6 equal width bins
+  if layer["bins"] is not None:
+    bins = list(heatmap_bins().loc[year, metric].loc[layer["bins"]])
+
+  df_map_year = map_index().year(year)
+  colors, color_scale = step_colors(df_map_year[metric], layer["fill_color"], bins, layer["legend_name"])
+  colors = {int(country_id): color for country_id, color in zip(df_map_year.country_id, colors) if color is not None}
+  return(colors, color_scale)
+
+# The html of the whole map with one metric in one year, as sent to the browser
+@versioned(maxsize=MAP_CACHE_SIZE, scope=map_scope)
+@stored("html", scope=map_scope)
+def map_html(metric, year):
+  folium = importlib.import_module("folium")
+  Fullscreen = importlib.import_module("folium.plugins").Fullscreen
+  from map_layers import ValueChoropleth
+  # Setup a folium map at a high-level zoom
+  map = folium.Map(zoom_start=1, tiles='cartodbpositron')
+  colors, color_scale = heatmap(metric, year)
+  # The cached legend is never added to a map itself, every map gets its own copy
+  ValueChoropleth(colors, copy.deepcopy(color_scale), name=MAP_LAYERS[metric]["layer_name"], **geometry_source()).add_to(map)
+  folium.LayerControl().add_to(map)
+  Fullscreen().add_to(map)
+  return(folium.Figure().add_child(map).render())
+
+# All the map years, for the map with the time slider
+def map_series_scope(*args):
+  return(datacache.scope(years=(MAP_START_YEAR, None)))
+
+# The colors of every map metric in every year, in the compact form of map_layers.TimeSliderChoropleth
+@versioned(scope=map_series_scope)
+def map_color_table():
+  from map_layers import step_bins
+  from branca.utilities import color_brewer
+  index = map_index()
+  n_ids = int(index.df.country_id.max()) + 1
+  table = {}
+  for metric, layer in MAP_LAYERS.items():
+    years = {}
+    for year in sorted(year for year in index.year_rows if year >= MAP_START_YEAR):
+      df_map_year = index.year(year)
+      bins = 6   # as in heatmap
+      if layer["bins"] is not None:
+        bins = list(heatmap_bins().loc[year, metric].loc[layer["bins"]])
+      bin_edges, color_idx = step_bins(df_map_year[metric], bins)
+      codes = np.full(n_ids, ".")
+      country_ids = df_map_year.country_id.values
+      shown = (country_ids >= 0) & (color_idx >= 0)
+      codes[country_ids[shown]] = color_idx[shown].astype(str)
+      years[int(year)] = {"bins": [float("%.4g" % edge) for edge in bin_edges], "colors": "".join(codes)}
+    table[metric] = {"name": layer["layer_name"], "legend": layer["legend_name"], "years": years,
+                     "palette": color_brewer(layer["fill_color"], n=len(bin_edges) - 1)}
+  return(table)
+
+# The html of the map of all the metrics and years, the year and metric are picked on the map in the browser.
+# metric and year are the ones it opens with
+@versioned(maxsize=MAP_CACHE_SIZE, scope=map_series_scope)
+@stored("html", scope=map_series_scope)
+def map_slider_html(metric, year):
+  folium = importlib.import_module("folium")
+  Fullscreen = importlib.import_module("folium.plugins").Fullscreen
+  from map_layers import TimeSliderChoropleth
+  map = folium.Map(zoom_start=1, tiles='cartodbpositron')
+  TimeSliderChoropleth(map_color_table(), metric, year, name="CO2 emissions", **geometry_source()).add_to(map)
+  Fullscreen().add_to(map)
+  return(folium.Figure().add_child(map).render())
 
 ### CHANGES PLOT
-# This caching does not seem to be changing much
-@st.cache()
-def changes_plot(df, year, rangeX):
-  df = df[df.year == year].copy()
+# x axis range of the animation, the growth percentages are clipped to it
+CHANGES_ANIMATION_RANGE_X = [-100, 100]
+# animate: one figure with a frame for every year from year on, played in the browser. The axes and colors stay fixed between the frames.
+@versioned(scope=changes_scope)
+@stored("plotly", scope=changes_scope)
+@slimmed()
+def changes_plot(year, rangeX, animate = False):
+  px = importlib.import_module("plotly.express")
+  if animate:
+    df = map_index().year(year, to_end = True)
+    df = df[df.co2 > 0]
+  else:
+    df = map_index().year(year)
   if rangeX is not None:
-    df["co2_growth_prct"] = df.co2_growth_prct.clip(rangeX[0] + 1, rangeX[1] - 1)    
+    df = df.assign(co2_growth_prct = df.co2_growth_prct.clip(rangeX[0] + 1, rangeX[1] - 1))    
+
+  title = "Annual CO2 output and percentage change in " + str(year)
+  range_y = None
+  range_color = None
+  if animate:
+    title = "Annual CO2 output and percentage change"
+    range_y = [df.co2.min() / 2, df.co2.max() * 2]
+    range_color = [df.gdp_per_capita.min(), df.gdp_per_capita.max()]
   
   fig = px.scatter(
     df, 
@@ -77,184 +168,116 @@ def changes_plot(df, year, rangeX):
     hover_name = "country", 
     log_y = True,
     range_x=rangeX,
+    range_y=range_y,
+    range_color=range_color,
+    animation_frame = "year" if animate else None,
+    animation_group = "country" if animate else None,
     hover_data = {"co2_growth_prct":False, "co2":False, "gdp_per_capita": False},
-    labels = {"co2": "CO2 output (t)", "co2_growth_prct": "CO2 percentage change", "gdp_per_capita": "GDP per capita"},
-    title = "Annual CO2 output and percentage change in " + str(year), 
+    labels = {"co2": "CO2 output (t)", "co2_growth_prct": "CO2 percentage change", "gdp_per_capita": "GDP per capita", "year": "Year"},
+    title = title, 
     width = 900,
     height=600
   )
 
   fig.add_vline(x = 0, line_color = "lime") #line_dash = "dash"
+  if animate:
+    # Half a second per year
+    fig.layout.updatemenus[0].buttons[0].args[1]["frame"]["duration"] = 500
   return(fig)
 
 
-# FUTURE CO@ EMISSIONS PREDICTION
-@st.cache()
-def model_future_CO2_emissions(country, predict_time, train_from):
-  df = get_OWID_data()
-  df_country = df[df.country == country]
-  fi = df_country[["country", "year", "co2", "population", "energy_per_capita"]]
-  fi = fi[df.year > train_from]
-  available_data_year     = fi[~ fi.isnull().any(axis = 1)    ].year.max()
-  available_co2_data_year = fi[~ fi.co2.isnull()].year.max()
-  years_cut_off = available_co2_data_year - available_data_year
-  shift_by = predict_time + years_cut_off
-  fi["co2_now"] = fi["co2"].shift(-shift_by) # All other variables are from the past
-  fi = fi[df.year <= available_data_year]
-  predict_from = available_co2_data_year + 1
-
-  training = fi[fi.year < predict_from - shift_by].copy()
-  test = fi[fi.year >= predict_from - shift_by].copy()
-
-  y_train = training.co2_now
-  X_train = training[["year", "population", "energy_per_capita"]]
-  X_test = test[["year", "population", "energy_per_capita"]]
-
-  model = smapi.OLS(y_train,X_train)
-  results = model.fit()
-
-  # The last recorded value will be prepended so that there are no gaps in the plot
-  last_recorded_value = pd.Series([df_country[df_country.year == available_co2_data_year].co2.values[0]])
-  prediction = results.predict(X_test)
-  prediction = pd.concat([last_recorded_value.copy(), prediction]).reset_index(drop = True)
-  prediction_years = test.year + shift_by
-  prediction_years = pd.concat([pd.Series([available_co2_data_year]), prediction_years]).reset_index(drop = True)
-
-  # https://tedboy.github.io/statsmodels_doc/generated/statsmodels.sandbox.regression.predstd.wls_prediction_std.html
-  a, lower_confidence ,upper_confidence = sm.sandbox.regression.predstd.wls_prediction_std(results, X_test)
-  lower_confidence = pd.concat([last_recorded_value.copy(), pd.Series(lower_confidence * 0.95)]).reset_index(drop = True)
-  upper_confidence = pd.concat([last_recorded_value.copy(), pd.Series(upper_confidence * 1.05)]).reset_index(drop = True)
-  result = pd.DataFrame({"year": prediction_years, "prediction": prediction, "lci": lower_confidence, "uci": upper_confidence})
-
-  return(result)
-
-
-# FUTURE METHANE EMISSIONS PREDICTION
-@st.cache()
-def model_future_methane_emissions(country, predict_time, train_from):
-  df = get_OWID_data()
-  fi = df[df.country == country]
-  fi = fi[["country", "year", "co2", "population", "methane"]]
-  fi = fi[df.year > train_from]
-  available_data_year = fi[~ fi.isnull().any(axis = 1)].year.max()
-  available_methane_data_year = fi[~ fi.methane.isnull()].year.max()
-  if(pd.isnull(available_data_year)):
-    return(pd.DataFrame({"year":[], "methane prediction": [], "muci": [], "mlci":[]}))
-  years_cut_off = available_methane_data_year - available_data_year
-  shift_by = predict_time + years_cut_off
-  fi["methane_now"] = fi["methane"].shift(-shift_by) # All other variables are from the past
-  fi = fi[df.year <= available_data_year]
-  predict_from = available_methane_data_year + 1  
-
-  training = fi[fi.year < predict_from - shift_by].copy()
-  test = fi[fi.year >= predict_from - shift_by].copy()
-
-  y_train = training.methane_now
-  X_train = training[["population", "year"]]
-  X_test = test[["population", "year"]]
-
-  model = smapi.OLS(y_train,X_train)
-  results = model.fit()
-
-  a, lower_confidence ,upper_confidence = sm.sandbox.regression.predstd.wls_prediction_std(results, X_test)
-  result = pd.DataFrame({"year": test.year + shift_by, "methane prediction": results.predict(X_test), "mlci": lower_confidence * 0.95, "muci": upper_confidence * 1.05})
-  return(result)
-
   ### EMISSIONS HISTORY PLOT
-@st.cache()
+# The regions that can be picked for the plot, and the year it starts from
+HISTORY_REGIONS = ["World", "Europe", "Finland", "Sweden", "Norway", "China", "United States"]
+HISTORY_START_YEAR = 1850
+# Gases of the plot, forecasts.FORECASTS targets that are totals -> name in the plot and the color of the prediction interval
+HISTORY_GASES = {"co2": ("CO2", "255, 0, 0"), "methane": ("methane", "0, 255, 0")}
+
+@versioned(scope=country_scope)
+@stored("plotly", scope=country_scope)
+@slimmed()
 def emissions_history_plot(country, from_year):
-  co2_prediction = model_future_CO2_emissions(country, 5, 1980)
-  methane_prediction = model_future_methane_emissions(country, 5, 2000)
-  df = get_OWID_data()
-  dfw = df[df["country"] == country]
-  df3 = dfw[dfw.year >= from_year].copy()
-  df3 = pd.merge(df3, co2_prediction, how = "outer", on=["year"])
-  df3 = pd.merge(df3, methane_prediction, how = "outer", on=["year"])
-  df3.rename({"co2": "CO2", "prediction": "CO2 prediction"}, axis = 1, inplace = True)
+  px = importlib.import_module("plotly.express")
+  go = importlib.import_module("plotly.graph_objs")
+  # Forecasts of all countries and gases are computed together, see forecasts.py. The gases are picked from the one table with
+  # a single pivot, so a gas more adds columns and traces, not another slice of the data
+  forecasts = forecast_index().country(country)
+  predictions = forecasts[forecasts.target.isin(list(HISTORY_GASES))].pivot(index="year", columns="target", values=["estimate", "lci", "uci"])
+  predictions = predictions.reindex(columns=pd.MultiIndex.from_product([["estimate", "lci", "uci"], list(HISTORY_GASES)]))
+  names = [name for name, color in HISTORY_GASES.values()]
+  predictions.columns = [{"estimate": "%s prediction", "lci": "lci %s", "uci": "uci %s"}[value] % HISTORY_GASES[gas][0]
+                         for value, gas in predictions.columns]
+  index = owid_index()
+  df3 = index.country(country, from_year)[["country", "year"] + list(HISTORY_GASES)]
+  df3 = df3.rename(columns={gas: name for gas, (name, color) in HISTORY_GASES.items()})
+  df3 = pd.merge(df3, predictions.reset_index(), how = "outer", on=["year"])
 
   fig = px.line(
     df3, 
     x = "year", 
-    y = ["CO2", "CO2 prediction", "methane", "methane prediction"],
+    y = [column for name in names for column in (name, name + " prediction")],
     labels = {"value": "million tonnes (Mt) of CO2 equivalent", "variable": "Greenhouse gas"},
-    title = "CO2 and methane emissions history for " + str(country),
+    title = "%s emissions history for %s" % (" and ".join(filter(None, [", ".join(names[:-1]), names[-1]])), country),
     width = 900,
     height = 500
   )
   fig.add_hline(y = 0, line_color = "black", line_dash = "dash")
-  fig.add_annotation( # add a text callout with arrow
-    text="Paris agreement", x=2016, y=1.05 * int(df3[df3.year == 2016].CO2), arrowhead=1, showarrow=True
-  )
-  fig.add_annotation( # add a text callout with arrow
-    text="Kyoto protocol", x=2005, y=1.05 * int(df3[df3.year == 2005].CO2), arrowhead=1, showarrow=True
-  )
-  fig.add_annotation( # add a text callout with arrow
-    text="WW1", x=1914, y=1.3 * int(df3[df3.year == 1914].CO2), arrowhead=1, showarrow=True
-  )
-  fig.add_annotation( # add a text callout with arrow
-    text="WW2", x=1939, y=1.3 * int(df3[df3.year == 1939].CO2), arrowhead=1,  showarrow=True
-  )
-  fig.add_annotation( # add a text callout with arrow
-    text="Early 1980's recession", x=1980, y=1.05 * int(df3[df3.year == 1980].CO2), arrowhead=1,  showarrow=True, ay = -50
-  )
-  fig.add_annotation( # add a text callout with arrow
-    text="The Great Depession", x=1930, y=1.3 * int(df3[df3.year == 1930].CO2), arrowhead=1,  showarrow=True, ay = -100
-  )
-  fig.add_annotation( # add a text callout with arrow
-    text="COVID pandemic", x=2019, y=0.99 * int(df3[df3.year == 2019].CO2), arrowhead=1,  showarrow=True, ay = 70
-  )
+  # Events to point out: text, year, height relative to the CO2 output of that year, length of the arrow
+  events = [
+    ("Paris agreement", 2016, 1.05, None), ("Kyoto protocol", 2005, 1.05, None), ("WW1", 1914, 1.3, None), ("WW2", 1939, 1.3, None),
+    ("Early 1980's recession", 1980, 1.05, -50), ("The Great Depession", 1930, 1.3, -100), ("COVID pandemic", 2019, 0.99, 70)
+  ]
+  for text, year, height, ay in events:
+    co2 = index.value(country, year, "co2")
+    # Countries without data for the year (or before it) get no callout
+    if np.isnan(co2):
+      continue
+    fig.add_annotation( # add a text callout with arrow
+      text=text, x=year, y=height * int(co2), arrowhead=1, showarrow=True, ay = ay
+    )
 
   # Confidence intervals
-  fig.add_trace(go.Scatter(x=df3.year, y = df3.uci,
-    fill=None,
-    mode='lines',
-    line_color="rgba(255, 0, 0, 0)",
-    name = ""
-  ))
-  fig.add_trace(go.Scatter(
-    x=df3.year, y = df3.lci,
-    fill='tonexty', # fill area between trace0 and trace1
-    mode='lines', line_color="rgba(255, 0, 0, 0)", fillcolor="rgba(255, 0, 0, 0.2)",
-    name = "95% confidence inteval for CO2"
-  ))
-  fig.add_trace(go.Scatter(x=df3.year, y = df3.muci,
-    fill=None,
-    mode='lines',
-    line_color="rgba(0, 255, 0, 0)",
-    name = ""
-  ))
-  fig.add_trace(go.Scatter(
-    x=df3.year, y = df3.mlci,
-    fill='tonexty', # fill area between trace0 and trace1
-    mode='lines', line_color="rgba(0, 255, 0, 0)", fillcolor = "rgba(0, 255, 0, 0.2)",
-    name = "95% confidence inteval for methane"
-  ))
+  for name, color in HISTORY_GASES.values():
+    fig.add_trace(go.Scatter(x=df3.year, y = df3["uci " + name],
+      fill=None,
+      mode='lines',
+      line_color="rgba(%s, 0)" % color,
+      name = ""
+    ))
+    fig.add_trace(go.Scatter(
+      x=df3.year, y = df3["lci " + name],
+      fill='tonexty', # fill area between trace0 and trace1
+      mode='lines', line_color="rgba(%s, 0)" % color, fillcolor="rgba(%s, 0.2)" % color,
+      name = "95% confidence inteval for " + name
+    ))
 
   return(fig)
 
 ### Sector breakdown pie chart
-@st.cache()
+@versioned(scope=no_scope)
+@stored("plotly", scope=no_scope)
+@slimmed()
 def sector_breakdown():
-  xls = pd.ExcelFile('./res/Global-GHG-Emissions-by-sector-based-on-WRI-2020.xlsx')
-  df_all = pd.read_excel(xls, 'All')
-  df_all = df_all.rename(columns={'Sub-sector (further breakdown)': 'Sub-sub-sector'})
-
-
-  energy = df_all[df_all["Sector"] == "Energy"]
-  industrial = df_all[df_all["Sector"] == "Industrial processes"]
-  waste = df_all[df_all["Sector"] == "Waste"]
-  AFOLU = df_all[df_all["Sector"] == "Agriculture, Forestry & Land Use (AFOLU)"]
+  go = importlib.import_module("plotly.graph_objs")
+  make_subplots = importlib.import_module("plotly.subplots").make_subplots
+  # The WRI breakdown of the global emissions, see sectors.py
+  cube = sector_cube()
+  shares = {"gas": "ghg", "measure": "share_pct"}
+  energy = cube.rollup(["sub_sector"], sector=ENERGY, **shares)
+  industrial = cube.slice(sector=INDUSTRY, **shares)
+  waste = cube.slice(sector=WASTE, **shares)
+  afolu = cube.slice(sector=AFOLU, **shares)
 
   # Create subplots: use 'domain' type for Pie subplot
   fig = make_subplots(rows=1, cols=4, specs=[[{'type':'domain'}, {'type':'domain'}, {'type':'domain'}, {'type':'domain'}]], subplot_titles=['Energy',"Agriculture, Forestry & Land", 'Industrial processes', "Waste" ])
 
-  fig.add_trace(go.Pie(labels=energy["Sub-sector"], values=energy["Share of global greenhouse gas emissions (%)"], scalegroup='one', name="Emissions from Energy"),
+  fig.add_trace(go.Pie(labels=energy.sub_sector.astype(str), values=energy.value, scalegroup='one', name="Emissions from Energy"),
                 1, 1)
-  fig.add_trace(go.Pie(labels=AFOLU["Sub-sub-sector"], values=AFOLU["Share of global greenhouse gas emissions (%)"], scalegroup='one', name="Emissions from AFOLU"),
+  fig.add_trace(go.Pie(labels=afolu.detail.astype(str), values=afolu.value, scalegroup='one', name="Emissions from AFOLU"),
                 1, 2)
-  fig.add_trace(go.Pie(labels=industrial["Sub-sub-sector"], values=industrial["Share of global greenhouse gas emissions (%)"],scalegroup='one', name="Emissions from Industrial processes"),
+  fig.add_trace(go.Pie(labels=industrial.detail.astype(str), values=industrial.value,scalegroup='one', name="Emissions from Industrial processes"),
                 1, 3)
-  fig.add_trace(go.Pie(labels=waste["Sub-sub-sector"], values=waste["Share of global greenhouse gas emissions (%)"], scalegroup='one', name="Emissions from Waste"),
+  fig.add_trace(go.Pie(labels=waste.detail.astype(str), values=waste.value, scalegroup='one', name="Emissions from Waste"),
                 1, 4)
 
   fig.update_traces(hoverinfo='label+percent', textinfo='none')
@@ -265,12 +288,18 @@ def sector_breakdown():
       
   return fig
 #### WORLD TEMPERATURE
-@st.cache()
+# The 30 year average of this year is taken to be 1 degree above the pre-industrial temperature
+WARMING_REFERENCE_YEAR = 2017
+@versioned(scope=no_scope)
+@stored("plotly", scope=no_scope)
+@slimmed()
 def world_temperature():
-  df_temp = pd.read_csv("globalTemperature.csv", header=1)
-  df_temp["30 year average"] = df_temp.rolling(window=30)["Temperature"].mean()
+  px = importlib.import_module("plotly.express")
+  # The yearly means and their rolling averages are kept up to date as the file gets new months, see temperature.py
+  series = temperature_feed(TEMPERATURE_FILE, windows=(30,)).update()
+  df_temp = series.frame("Temperature")
   # preindustrialTemp = (df_temp[df_temp.Year <= 1900][['Temperature']].mean())[0]
-  preindustrialTemp = df_temp.loc[df_temp.Year == 2017, '30 year average'].values[0] - 1
+  preindustrialTemp = series.mean_at(WARMING_REFERENCE_YEAR, 30) - 1
   df_temp["1 degree increase"] = preindustrialTemp + 1
   df_temp["1.5 degree increase"] = preindustrialTemp + 1.5
   fig = px.line(
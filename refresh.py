@@ -0,0 +1,144 @@
+# Updates the data files of the app to a new OWID csv, recomputing only what the new data changes:
+#   python refresh.py path/to/owid-co2-data.csv
+# The new csv is compared to the current data cell by cell. Only the forecasts of the countries whose data has changed are recomputed,
+# and the changed countries and years are recorded in datacache.CHANGES_FILE, so that a running app only drops the cached values
+# and stored figures of those countries and years. The new files are written next to the old ones and renamed into place after
+# the change has been recorded, the app keeps using the old version until all of them have been replaced.
+# If the countries themselves change (new countries or iso codes) the country index and map geometry are rebuilt and everything is recomputed.
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import datacache
+import plots   # all the data files are registered with datacache when the app's modules are imported
+from util import OWID_SNAPSHOT, get_OWID_data, compact_OWID
+from countries import GEO_FILE, COUNTRY_INDEX, build_country_index, add_country_ids
+from geometry import GEOMETRY_LEVELS, geometry_file, simplify_geometry
+from forecasts import FORECAST_FILE, FORECASTS, PREDICT_TIME, forecast_columns, forecast_targets, forecast_table
+from ingest import read_OWID_csv
+
+# Number of changes kept in CHANGES_FILE
+CHANGES_KEPT = 20
+KEY = ["country", "year"]
+# Column name of the rows that were added or removed
+ROW = "*"
+
+
+# Cells that differ between two OWID tables, as a table with columns country, year, column.
+# Rows only in one of the tables are listed once with column ROW.
+def diff_snapshots(old, new):
+  old = old.drop_duplicates(KEY).set_index(KEY)
+  new = new.drop_duplicates(KEY).set_index(KEY)
+  index = old.index.intersection(new.index)
+  cells = [pd.DataFrame({"country": rows.get_level_values(0), "year": rows.get_level_values(1), "column": ROW})
+           for rows in [old.index.difference(new.index), new.index.difference(old.index)]]
+  for column in sorted(set(old.columns) | set(new.columns)):
+    before = old[column].reindex(index) if column in old else pd.Series(np.nan, index=index)
+    after = new[column].reindex(index) if column in new else pd.Series(np.nan, index=index)
+    if before.dtype.name == "category" or after.dtype.name == "category":
+      before, after = before.astype(object), after.astype(object)
+    changed = before.ne(after).values & ~(before.isnull().values & after.isnull().values)
+    rows = index[changed]
+    cells.append(pd.DataFrame({"country": rows.get_level_values(0), "year": rows.get_level_values(1), "column": column}))
+  return(pd.concat(cells, ignore_index=True))
+
+
+# The forecast table with the forecasts of the countries whose data a forecast uses recomputed from df.
+# All the targets of those countries are recomputed together, they share the countries' feature matrices
+def refresh_forecasts(table, df, cells, predict_time=PREDICT_TIME):
+  columns = set([ROW] + forecast_columns()) - set(KEY)
+  countries = cells[cells.column.isin(columns)].country.unique()
+  if len(countries):
+    update = forecast_targets(df[df.country.isin(countries)], FORECASTS, [predict_time]).drop(columns="predict_time")
+    table = pd.concat([table[~table.country.isin(countries)], update])
+  return(pd.concat([table[table.target == target].sort_values(KEY) for target in FORECASTS], ignore_index=True))
+
+
+# Temporary file next to path, renamed to path once the change is recorded
+def temporary_path(path):
+  fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+  os.close(fd)
+  return(tmp)
+
+def write_json(path, value):
+  tmp = temporary_path(path)
+  with open(tmp, "w") as f:
+    json.dump(value, f)
+  os.replace(tmp, path)
+
+
+# Writes the new data files and records the change, then renames the files into place. Returns the recorded change (None: no changes)
+def refresh(csv_path):
+  new = read_OWID_csv(csv_path)
+  old = get_OWID_data()
+  cells = diff_snapshots(old, new)
+  if cells.empty:
+    return(None)
+
+  files = {}
+  try:
+    files[OWID_SNAPSHOT] = temporary_path(OWID_SNAPSHOT)
+    new.to_parquet(files[OWID_SNAPSHOT], index=False)
+    columns = forecast_columns()
+    files[FORECAST_FILE] = temporary_path(FORECAST_FILE)
+    # With the types the app computes the forecasts with, see forecasts.build_forecast_table
+    data = compact_OWID(new[columns]).astype({"country": object})
+    refresh_forecasts(forecast_table(), data, cells).to_parquet(files[FORECAST_FILE], index=False)
+
+    # The country ids change with the countries, and with them the map
+    pairs = lambda df: set(zip(df.country, df.iso_code.astype(object).fillna("")))
+    countries_changed = pairs(old) != pairs(new)
+    if countries_changed:
+      with open(GEO_FILE) as f:
+        geo = json.load(f)
+      index = build_country_index(new[["country", "iso_code"]], geo)
+      files[COUNTRY_INDEX] = temporary_path(COUNTRY_INDEX)
+      index.to_parquet(files[COUNTRY_INDEX], index=False)
+      for level in GEOMETRY_LEVELS:
+        if os.path.exists(geometry_file(level)):
+          files[geometry_file(level)] = temporary_path(geometry_file(level))
+          with open(files[geometry_file(level)], "w") as f:
+            json.dump(simplify_geometry(add_country_ids(geo, index), level), f, separators=(",", ":"))
+  except BaseException:
+    for tmp in files.values():
+      os.unlink(tmp)
+    raise
+
+  digests = datacache.file_digests()
+  previous = datacache.version_of(digests)
+  digests.update({path: datacache.file_digest(tmp) for path, tmp in files.items()})
+  change = {
+    "version": datacache.version_of(digests),
+    "previous": previous,
+    "countries": None if countries_changed else sorted(cells.country.unique()),
+    "years": None if countries_changed else sorted(int(year) for year in cells.year.unique()),
+    "columns": sorted(cells.column.unique()),
+    "files": {path: digests[path] for path in files},
+    "written": time.time()
+  }
+  write_json(datacache.CHANGES_FILE, (datacache.read_changes() + [change])[-CHANGES_KEPT:])
+  for path, tmp in files.items():
+    os.replace(tmp, path)
+  return(change)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Update the app's data files to a new OWID csv")
+  parser.add_argument("csv", help="the new OWID co2 data csv")
+  args = parser.parse_args()
+
+  datacache.dataset_version()
+  change = refresh(args.csv)
+  if change is None:
+    print("No changes")
+  elif change["countries"] is None:
+    print("The countries have changed, everything is recomputed. Version", change["previous"], "->", change["version"])
+  else:
+    print("Version", change["previous"], "->", change["version"])
+    print(len(change["countries"]), "countries and", len(change["years"]), "years changed:", ", ".join(change["countries"][:20]))
+    print("Columns:", ", ".join(change["columns"]))
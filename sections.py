@@ -0,0 +1,81 @@
+import inspect
+import threading
+import weakref
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+
+# The figures of the page as sections with declared inputs: plotly_section(container, name, function, *inputs) shows function(*inputs).
+# Streamlit reruns the whole page on every widget change. A section whose inputs and data version are the same as in the session's
+# last run does not call its function again and shows what it showed then, so moving the scatter year slider does no work for the map
+# or the history plot. The plotly figures are turned into what streamlit sends once per figure, and shared by all the sessions.
+# That uses streamlit internals (plotly_chart.marshall and DeltaGenerator._enqueue) of the version pinned in requirements.txt. With other
+# signatures the charts are sent with st.plotly_chart.
+
+_lock = threading.Lock()
+# id of a figure -> its marshalled PlotlyChart proto, dropped with the figure (figures are not hashable)
+_charts = {}
+
+
+# True if the streamlit internals chart_proto and plotly_section use have the expected signatures
+def private_api():
+  try:
+    from streamlit.elements.plotly_chart import marshall
+    from streamlit.delta_generator import DeltaGenerator
+    marshall_params = list(inspect.signature(marshall).parameters)[:4]
+    enqueue_params = list(inspect.signature(DeltaGenerator._enqueue).parameters)[:3]
+  except (ImportError, AttributeError, TypeError, ValueError):
+    return(False)
+  return(marshall_params == ["proto", "figure_or_data", "use_container_width", "sharing"] and
+         enqueue_params == ["self", "delta_type", "element_proto"])
+
+PRIVATE_API = private_api()
+
+
+def chart_proto(fig):
+  from streamlit.elements.plotly_chart import marshall
+  from streamlit.proto.PlotlyChart_pb2 import PlotlyChart
+  with _lock:
+    proto = _charts.get(id(fig))
+  if proto is None:
+    proto = PlotlyChart()
+    marshall(proto, fig, False, "streamlit")
+    with _lock:
+      if id(fig) not in _charts:
+        weakref.finalize(fig, _charts.pop, id(fig), None)
+      _charts[id(fig)] = proto
+  return(proto)
+
+
+# name -> (inputs and data version, value) of the sections of the session
+def session_sections():
+  try:
+    if "sections" not in st.session_state:
+      st.session_state["sections"] = {}
+    return(st.session_state["sections"])
+  except KeyError:
+    # Run without a streamlit server (python world_map.py), there is no session to keep them in
+    return({})
+
+# What the section showed in the session's last run, recomputed when its inputs or the data (version: client.data_version(), read once
+# per run by the page) have changed
+def section_value(name, function, inputs, version):
+  sections = session_sections()
+  key = (inputs, version)
+  if name not in sections or sections[name][0] != key:
+    sections[name] = (key, function(*inputs))
+  return(sections[name][1])
+
+
+def plotly_section(container, name, function, *inputs, version):
+  fig = section_value(name, function, inputs, version)
+  if not PRIVATE_API:
+    return(container.plotly_chart(fig))
+  # The same as container.plotly_chart(fig) without validating and serializing the figure again
+  return(container._enqueue("plotly_chart", chart_proto(fig)))
+
+def html_section(container, name, function, *inputs, version, height=None, width=None):
+  html = section_value(name, function, inputs, version)
+  with container:
+    components.html(html, height=height, width=width)
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import re
+import os
+
+import datacache
+from datacache import versioned
+
+# Emissions by sector from all the files in res/, in one long table (the sector cube) with a row per
+# entity, year, gas, measure and sector:
+#   entity, code: country or region and its iso code
+#   gas: "ghg" (all greenhouse gases in CO2 equivalents) or "co2"
+#   measure: "t" (tonnes), "t_per_capita" or "share_pct" (share of the global emissions in percent)
+#   sector, sub_sector, detail: the sector hierarchy of the WRI breakdown. The CAIT sectors of the csv files are put under
+#   the WRI sector they belong to, with the CAIT sector as the sub_sector.
+# ingest.py writes it to SECTOR_CUBE, so the app does not parse the Excel file.
+WRI_FILE = "./res/Global-GHG-Emissions-by-sector-based-on-WRI-2020.xlsx"
+# file -> (gas, measure)
+CAIT_FILES = {
+  "./res/ghg-emissions-by-sector.csv": ("ghg", "t"),
+  "./res/co-emissions-by-sector.csv": ("co2", "t"),
+  "./res/per-capita-ghg-sector.csv": ("ghg", "t_per_capita")
+}
+SECTOR_CUBE = "sector-cube.parquet"
+# The year of the WRI breakdown
+WRI_YEAR = 2016
+for path in [WRI_FILE, SECTOR_CUBE, *CAIT_FILES]:
+  datacache.watch_file(path)
+
+ENERGY = "Energy"
+INDUSTRY = "Industrial processes"
+WASTE = "Waste"
+AFOLU = "Agriculture, Forestry & Land Use (AFOLU)"
+# CAIT sector (the column name without the source) -> WRI sector
+CAIT_SECTORS = {
+  "Agriculture": AFOLU, "Land-Use Change and Forestry": AFOLU, "Waste": WASTE, "Industry": INDUSTRY,
+  "Building": ENERGY, "Buildings": ENERGY, "Transport": ENERGY, "Electricity & Heat": ENERGY, "Other Fuel Combustion": ENERGY,
+  "Manufacturing & Construction": ENERGY, "Manufacturing/Construction energy": ENERGY,
+  "Fugitive Emissions": ENERGY, "Fugitive from energy production": ENERGY,
+  "Bunker Fuels": ENERGY, "International aviation & shipping": ENERGY
+}
+CUBE_COLUMNS = ["entity", "code", "year", "gas", "measure", "sector", "sub_sector", "detail", "value"]
+
+
+# "Transport (per capita) (GHG Emissions, CAIT)" -> "Transport"
+def cait_sector(column):
+  return(re.sub(r"\s*\(.*$", "", column))
+
+
+# One of the CAIT csv files in the long format of the cube
+def read_cait_file(path, gas, measure):
+  df = pd.read_csv(path)
+  df = df.melt(id_vars=["Entity", "Code", "Year"], var_name="column", value_name="value").dropna(subset=["value"])
+  sub_sector = df.column.map(cait_sector)
+  return(pd.DataFrame({
+    "entity": df.Entity.values, "code": df.Code.values, "year": df.Year.values, "gas": gas, "measure": measure,
+    "sector": sub_sector.map(CAIT_SECTORS).values, "sub_sector": sub_sector.values, "detail": None, "value": df.value.values
+  }))
+
+
+# The WRI breakdown of the global emissions
+def read_wri_file(path=WRI_FILE):
+  df = pd.read_excel(path, "All")
+  return(pd.DataFrame({
+    "entity": "World", "code": "OWID_WRL", "year": WRI_YEAR, "gas": "ghg", "measure": "share_pct",
+    "sector": df["Sector"].values, "sub_sector": df["Sub-sector"].values, "detail": df["Sub-sector (further breakdown)"].values,
+    "value": df["Share of global greenhouse gas emissions (%)"].values
+  }))
+
+
+# All the files in one compactly typed table, sorted so that every gas, measure and entity is a contiguous block of rows
+def build_sector_cube():
+  tables = [read_wri_file()] + [read_cait_file(path, gas, measure) for path, (gas, measure) in CAIT_FILES.items()]
+  cube = pd.concat(tables, ignore_index=True)[CUBE_COLUMNS]
+  cube = cube.sort_values(["gas", "measure", "entity", "year", "sector", "sub_sector"], kind="stable").reset_index(drop=True)
+  types = {column: "category" for column in ["entity", "code", "gas", "measure", "sector", "sub_sector", "detail"]}
+  return(cube.astype(dict(types, year="int16", value="float32")))
+
+
+# The cube with the row range of every (gas, measure, entity) block, so a query only looks at the rows of its block
+class SectorCube:
+
+  def __init__(self, cube):
+    self.cube = cube
+    codes = [cube[column].cat.codes.values for column in ["gas", "measure", "entity"]]
+    changed = np.zeros(max(len(cube) - 1, 0), dtype=bool)
+    for column_codes in codes:
+      changed |= column_codes[1:] != column_codes[:-1]
+    starts = np.flatnonzero(np.r_[True, changed]) if len(cube) else np.array([], dtype=int)
+    ends = np.r_[starts[1:], len(cube)]
+    keys = zip(*[cube[column].values[starts] for column in ["gas", "measure", "entity"]])
+    self.blocks = {key: (start, end) for key, start, end in zip(keys, starts, ends)}
+
+  # Rows matching all the filters. A filter is a value or a list of values, gas, measure and entity select blocks of rows
+  def slice(self, gas=None, measure=None, entity=None, **filters):
+    def matches(value, wanted):
+      return(wanted is None or value == wanted or (isinstance(wanted, (list, tuple, set)) and value in wanted))
+    ranges = [rows for (g, m, e), rows in self.blocks.items() if matches(g, gas) and matches(m, measure) and matches(e, entity)]
+    rows = np.concatenate([np.arange(start, end) for start, end in sorted(ranges)]) if ranges else np.array([], dtype=int)
+    df = self.cube.iloc[rows]
+    for column, wanted in filters.items():
+      if wanted is not None:
+        df = df[df[column].isin(wanted if isinstance(wanted, (list, tuple, set)) else [wanted])]
+    return(df)
+
+  # Sum of the values of the rows matching the filters for every combination of the by columns, e.g.
+  # rollup(["sector"], gas="ghg", measure="t", entity="Finland", year=2016)
+  def rollup(self, by, **filters):
+    df = self.slice(**filters)
+    return(df.groupby(by, observed=True, sort=True).value.sum().reset_index())
+
+
+@versioned()
+def sector_cube():
+  if os.path.exists(SECTOR_CUBE):
+    cube = pd.read_parquet(SECTOR_CUBE)
+  else:
+    cube = build_sector_cube()
+  return(SectorCube(cube))
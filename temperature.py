@@ -0,0 +1,174 @@
+import threading
+import hashlib
+import os
+
+import pandas as pd
+
+# Reading of NASA GISTEMP temperature tables (https://data.giss.nasa.gov/gistemp/), line by line.
+# Works on the csv files (globalTemperature.csv, GLB.Ts+dSST.csv, the zonal ZonAnn.Ts+dSST.csv) and the whitespace separated
+# txt tables, which repeat their header every 20 years and give the values in hundredths of a degree.
+# A data line is one that starts with a year, the header is the last line that started with "Year" before it.
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+# A value of the table, None for the missing markers (*** or ****) and empty cells
+def parse_value(text, scale=1.0):
+  text = text.strip()
+  if not text or text.strip("*") == "" or text.lower() == "nan":
+    return(None)
+  return(float(text) * scale)
+
+
+# Splits a line of a csv or txt table
+def split_line(line):
+  if "," in line:
+    return([cell.strip() for cell in line.split(",")])
+  return(line.split())
+
+
+# Parses one line with the header in effect before it. Returns the header in effect after it and the row (year, {column: value or None})
+# if the line is a data line. header is (columns, scale)
+def parse_line(line, header):
+  cells = split_line(line)
+  if not cells:
+    return(header, None)
+  if cells[0] == "Year":
+    # The txt tables are in 0.01 degrees and have no commas
+    return((cells, 1.0 if "," in line else 0.01), None)
+  if header is None or not (cells[0].isdigit() and len(cells[0]) == 4):
+    return(header, None)
+  columns, scale = header
+  values = {column: parse_value(cell, scale) for column, cell in zip(columns[1:], cells[1:]) if column != "Year"}
+  return(header, (int(cells[0]), values))
+
+
+# One table row at a time: (year, {column: value or None}). lines can be a file, read as it goes
+def parse_gistemp(lines):
+  header = None
+  for line in lines:
+    header, row = parse_line(line, header)
+    if row is not None:
+      yield(row)
+
+
+# Mean of the months that have a value, None if none has
+def annual_mean(values):
+  months = [values[month] for month in MONTHS if values.get(month) is not None]
+  return(sum(months) / len(months) if months else None)
+
+
+# Yearly values with their rolling means, updated a year at a time.
+# Adding or changing the latest year recomputes only the windows that contain it, O(window) instead of the whole history.
+# Like pandas' rolling(window).mean(), a mean is only given when all the years of the window have a value.
+class RollingSeries:
+
+  def __init__(self, windows=(30,)):
+    self.windows = list(windows)
+    self.years = []
+    self.values = []
+    self.means = {window: [] for window in self.windows}
+
+  def _mean(self, window, i):
+    if i + 1 < window:
+      return(None)
+    values = self.values[i + 1 - window:i + 1]
+    if any(value is None for value in values):
+      return(None)
+    return(sum(values) / window)
+
+  # Adds a year after the last one, or changes the value of a year already in the series
+  def set(self, year, value):
+    if self.years and year <= self.years[-1]:
+      # The years are consecutive
+      i = year - self.years[0]
+      if i < 0:
+        raise ValueError("year %d is before the start of the series" % year)
+      self.values[i] = value
+    else:
+      if self.years and year != self.years[-1] + 1:
+        # Years without data in between
+        for missing in range(self.years[-1] + 1, year):
+          self.set(missing, None)
+      self.years.append(year)
+      self.values.append(value)
+      for window in self.windows:
+        self.means[window].append(None)
+      i = len(self.years) - 1
+    for window in self.windows:
+      for j in range(i, min(i + window, len(self.years))):
+        self.means[window][j] = self._mean(window, j)
+
+  def mean_at(self, year, window):
+    i = year - self.years[0] if self.years else -1
+    if i < 0 or i >= len(self.years):
+      return(None)
+    return(self.means[window][i])
+
+  def frame(self, value_name="value"):
+    columns = {"Year": self.years, value_name: self.values}
+    columns.update({"%d year average" % window: self.means[window] for window in self.windows})
+    return(pd.DataFrame(columns).astype({column: float for column in columns if column != "Year"}))
+
+
+# Follows a GISTEMP file as it gets new data. The first update reads the whole file, the next ones only parse the lines from the last
+# data line on (GISTEMP rewrites the current year as its months come in). If anything before that line has changed, for example
+# when older values are revised, the file is parsed again from the start.
+# column: the table column used as the yearly value, None for the mean of the months
+class TemperatureFeed:
+
+  def __init__(self, path, column=None, windows=(30,)):
+    self.path = path
+    self.column = column
+    self.windows = windows
+    self.lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    self.series = RollingSeries(self.windows)
+    self.rows = {}
+    # Byte offset of the last data line, the header in effect there and the hash of the file before it
+    self.offset = 0
+    self.header = None
+    self.prefix = hashlib.sha1().hexdigest()
+    self.stamp = None
+
+  def update(self):
+    with self.lock:
+      stat = os.stat(self.path)
+      if self.stamp == (stat.st_size, stat.st_mtime_ns):
+        return(self.series)
+      with open(self.path, "rb") as f:
+        if hashlib.sha1(f.read(self.offset)).hexdigest() != self.prefix:
+          self.reset()
+        f.seek(self.offset)
+        offset, header = self.offset, self.header
+        for line in f:
+          header, row = parse_line(line.decode("utf-8"), header)
+          if row is not None:
+            year, values = row
+            self.rows[year] = values
+            self.series.set(year, annual_mean(values) if self.column is None else values.get(self.column))
+            self.offset, self.header = offset, header
+          offset += len(line)
+        f.seek(0)
+        self.prefix = hashlib.sha1(f.read(self.offset)).hexdigest()
+      self.stamp = (stat.st_size, stat.st_mtime_ns)
+      return(self.series)
+
+  # All the columns of the table, a row per year
+  def table(self):
+    with self.lock:
+      return(pd.DataFrame.from_dict(self.rows, orient="index").rename_axis("Year").reset_index())
+
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+# The feed of a file, shared by all the sessions
+def temperature_feed(path, column=None, windows=(30,)):
+  with _feeds_lock:
+    key = (path, column, tuple(windows))
+    if key not in _feeds:
+      _feeds[key] = TemperatureFeed(path, column, windows)
+    return(_feeds[key])
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+
+# A table sorted by country and year, with the row range of every country and the rows of every year.
+# Getting a country's or a year's data is then a slice instead of a scan over the whole table.
+# A table that is already sorted (like util.owid_dataset) is used as it is, without a copy.
+class SeriesIndex:
+
+  def __init__(self, df):
+    if not pd.MultiIndex.from_arrays([df.country, df.year]).is_monotonic_increasing:
+      df = df.sort_values(["country", "year"], kind="stable").reset_index(drop=True)
+    self.df = df
+    self.years = self.df.year.values
+    countries = np.asarray(self.df.country)
+    starts = np.flatnonzero(np.r_[True, countries[1:] != countries[:-1]]) if len(countries) else np.array([], dtype=int)
+    ends = np.r_[starts[1:], len(countries)]
+    self.country_rows = {country: (start, end) for country, start, end in zip(countries[starts], starts, ends)}
+    # Row numbers of every year, in country order
+    order = np.argsort(self.years, kind="stable")
+    sorted_years = self.years[order]
+    year_starts = np.flatnonzero(np.r_[True, sorted_years[1:] != sorted_years[:-1]]) if len(order) else np.array([], dtype=int)
+    year_ends = np.r_[year_starts[1:], len(order)]
+    self.year_rows = {year: order[start:end] for year, start, end in zip(sorted_years[year_starts], year_starts, year_ends)}
+
+  # Rows of one country sorted by year, optionally only from from_year on
+  def country(self, country, from_year=None):
+    start, end = self.country_rows.get(country, (0, 0))
+    if from_year is not None:
+      start += np.searchsorted(self.years[start:end], from_year)
+    return(self.df.iloc[start:end])
+
+  # Rows of one year, or of all the years from year on
+  def year(self, year, to_end=False):
+    if to_end:
+      rows = [self.year_rows[y] for y in sorted(self.year_rows) if y >= year]
+      rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+    else:
+      rows = self.year_rows.get(year, np.array([], dtype=int))
+    return(self.df.iloc[rows])
+
+  # Value of column for one country and year, NaN if there is no such row
+  def value(self, country, year, column):
+    start, end = self.country_rows.get(country, (0, 0))
+    i = start + np.searchsorted(self.years[start:end], year)
+    if i < end and self.years[i] == year:
+      return(self.df[column].values[i])
+    return(np.nan)
@@ -1,66 +1,85 @@
-from pandas.core.frame import DataFrame
-import streamlit as st
-from streamlit_folium import folium_static
 import pandas as pd
-import folium
-import plotly.express as px
-import time
-from sklearn.linear_model import LinearRegression
-from folium.plugins import Fullscreen
-import statsmodels.api as smapi
-import statsmodels as sm
-import plotly.graph_objs as go
-
-
-@st.cache()
-def get_OWID_data():
+import numpy as np
+import os
+
+import datacache
+from datacache import versioned
+
+OWID_CSV = "owid-co2-data_25_11_2021.csv"
+# Columnar copy of OWID_CSV written by ingest.py
+OWID_SNAPSHOT = "owid-co2-data_25_11_2021.parquet"
+datacache.watch_file(OWID_CSV)
+datacache.watch_file(OWID_SNAPSHOT)
+
+# columns: list of the columns the caller needs, None reads all of them.
+# The data as it is in the file, the app uses owid_dataset
+def get_OWID_data(columns=None):
   #url = 'http://raw.githubusercontent.com/owid/co2-data/master/owid-co2-data.csv'
   #df = pd.read_csv(url)
-  df = pd.read_csv("owid-co2-data_25_11_2021.csv")
+  # The snapshot only reads the requested columns from disk, the csv has to be parsed whole
+  if os.path.exists(OWID_SNAPSHOT):
+    df = pd.read_parquet(OWID_SNAPSHOT, columns=columns)
+  else:
+    df = pd.read_csv(OWID_CSV, usecols=columns)
+  return(df)
+
+# Columns of the OWID data used by the plots
+OWID_SERIES_COLUMNS = ["country", "year", "co2", "methane", "nitrous_oxide", "total_ghg", "population", "energy_per_capita"]
+# All the columns of the OWID data the app uses
+OWID_COLUMNS = ["iso_code", "country", "year", "co2", "co2_per_capita", "co2_growth_prct", "methane", "nitrous_oxide", "total_ghg", "population", "gdp", "energy_per_capita"]
+MAP_COLUMNS = ["year", "country", "co2", "co2_per_capita", "co2_growth_prct", "methane", "gdp", "population"]
+
+
+# Makes the arrays of df read-only, so that changing the shared data in place raises an error instead of changing it for every session.
+# Selecting rows or columns still gives a new (writable) table.
+def read_only(df):
+  for block in df._mgr.blocks:
+    if isinstance(block.values, np.ndarray):
+      block.values.flags.writeable = False
   return(df)
 
-@st.cache()
+
+# Country names and iso codes as categories, years as int16 and the values as float32
+def compact_OWID(df):
+  types = {"country": "category", "iso_code": "category", "year": "int16"}
+  types.update({column: "float32" for column in df.columns if df[column].dtype == "float64"})
+  return(df.astype({column: dtype for column, dtype in types.items() if column in df}))
+
+
+# The OWID_COLUMNS of the OWID data, sorted by country and year, compactly typed and read-only. All the sessions share this one table.
+@versioned()
+def owid_dataset():
+  df = compact_OWID(get_OWID_data(OWID_COLUMNS))
+  df = df.sort_values(["country", "year"], kind="stable").reset_index(drop=True)
+  return(read_only(df))
+
+# OWID data indexed by country and year, see timeseries.py
+@versioned()
+def owid_index():
+  from timeseries import SeriesIndex
+  return(SeriesIndex(owid_dataset()))
+
+@versioned()
 def max_year():
-  df = get_OWID_data()
-  max_y = df.year.max()
+  max_y = owid_dataset().year.max()
   return(max_y)
 
 
 # Cached function for downloading/prepping data
-@st.cache(hash_funcs={tuple: lambda x: 1})   # This hashing function is just so that the program doesn't stop. I don't know how it should be.
+@versioned()
 def load_data(start_year, end_year):
-	df = get_OWID_data()
-
-	country_geo = 'world-countries.json'
+	from countries import country_index, country_geo   # countries imports util
+	df = owid_dataset()
 
-	df_map = df[["year", "country", "co2", "co2_per_capita", "co2_growth_prct", "methane", "gdp", "population"]]
-	df_map["gdp_per_capita"] = df_map["gdp"] / df_map["population"]
+	# Attach the integer country ids that the map is keyed on, and remove regions and other non-countries from the data.
+	# Looked up once per country name and spread to the rows through the category codes
+	index = country_index().set_index("country")
+	countries = df.country.cat.categories
+	codes = df.country.cat.codes.values
+	country_id = index.country_id.reindex(countries).fillna(-1).astype("int32").values
+	rows = ~index.is_aggregate.reindex(countries).fillna(True).astype(bool).values[codes]
+	df_map = df.loc[rows, MAP_COLUMNS]
+	df_map = df_map.assign(gdp_per_capita=df_map["gdp"] / df_map["population"], country_id=country_id[codes[rows]])
 	# df_map = df_map[df_map.year == 2019]
 
-	# Change country names so that folium understands them
-	proper_name = {
-			"United States": "United States of America", "Czechia": "Czech Republic", "Serbia": "Republic of Serbia",
-			"North Macedonia": "Macedonia", "Congo": "Republic of the Congo", "Democratic Republic of Congo": "Democratic Republic of the Congo",
-			"Tanzania": "United Republic of Tanzania", "Cote d'Ivoire": "Ivory Coast", "Guinea-Bissau": "Guinea Bissau", "Eswatini": "Swaziland",
-			"Bahamas": "The Bahamas",
-			"Timor": "East Timor" # Timor is an island, East Timor is a country 
-			}
-
-	for i in range(len(df_map)):
-			name = df_map.iloc[i].country
-			if name in proper_name:
-				df_map.at[i, "country"] = proper_name[name]
-
-	# For the countries below we might have to do something more fancy. Folium recognises them, but OWID not
-	# I guess Somaliland is considered as Somalia
-	# Northern Cyprus is considered as cyprus
-	# Western Sahara is probably under Morocco
-	# Falkland Islands. I guess they belong to UK?
-	# French Southern and Antarctic Lands probably should be considered as France
-
-	# Remove some non-countries from the data
-	not_countries = ["Africa", "Asia (excl. China & India)", "Asia", "EU-27", "EU-28", "Europe", "Europe (excl. EU-27)", "Europe (excl. EU-28)", "International transport",
-									"North America (excl. USA)", "North America", "Oceania", "South America", "World"] # Antarctica is also not a country, but is shown on the map
-
-	df_map = df_map[~df_map.country.isin(not_countries)]
-	return (country_geo, df_map)
\ No newline at end of file
+	return (country_geo(), read_only(df_map))
\ No newline at end of file
@@ -0,0 +1,122 @@
+# Computes every figure the app can show into the figure store (figurestore.py) before a replica starts serving:
+#   python warmup.py --workers 8
+# All the regions of the emissions history plot, the map of every metric and year, and the changes plot of every year are computed
+# across a process pool. The store is shared through its folder, so the app reads them from there on the first view.
+# Then a fresh process looks up a sample of the figures the way the app does, and the exit code is 1 if a figure failed or was not found
+# there, so it can be used as a readiness step.
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+# Tasks run this long or longer are listed at the end
+SLOW_TASK_S = 5.0
+# Figures of every kind looked up again by a fresh process
+CHECKED_PER_FIGURE = 3
+
+
+# (function name in plots, args) of every figure
+def warmup_tasks(kinds=("history", "maps", "changes", "static")):
+  import plots
+  from util import max_year
+  end_year = int(max_year())
+  tasks = []
+  if "history" in kinds:
+    tasks += [("emissions_history_plot", (region, plots.HISTORY_START_YEAR)) for region in plots.HISTORY_REGIONS]
+  if "maps" in kinds:
+    tasks += [("map_slider_html", ("co2_per_capita", end_year))]
+    tasks += [("map_html", (metric, year)) for year in range(end_year, plots.MAP_START_YEAR - 1, -1) for metric in plots.MAP_LAYERS]
+  if "changes" in kinds:
+    # The slider starts at end_year - 2
+    years = range(end_year - 2, plots.MAP_START_YEAR - 1, -1)
+    tasks += [("changes_plot", (year, None)) for year in years]
+    tasks += [("changes_plot", (year, plots.CHANGES_ANIMATION_RANGE_X, True)) for year in years]
+  if "static" in kinds:
+    tasks += [("world_temperature", ()), ("sector_breakdown", ())]
+  return(tasks)
+
+
+def run_task(task):
+  import plots
+  name, args = task
+  start = time.perf_counter()
+  try:
+    getattr(plots, name)(*args)
+    error = None
+  except Exception:
+    error = traceback.format_exc()
+  return(task, time.perf_counter() - start, error)
+
+
+# True if the figure of the task is in the store for the process running it
+def stored_task(task):
+  import plots
+  import figurestore
+  name, args = task
+  return(task, figurestore.read_entry(getattr(plots, name).stored_path(*args)) is not None)
+
+
+# The tasks a fresh process does not find in the store, out of the first and last CHECKED_PER_FIGURE of every figure
+def check_stored(tasks):
+  sample = []
+  for name in dict.fromkeys(task[0] for task in tasks):
+    named = [task for task in tasks if task[0] == name]
+    # By position, the arguments can hold lists (the axis range of changes_plot) and are not hashable
+    picked = sorted(set(range(len(named))[:CHECKED_PER_FIGURE]) | set(range(len(named))[-CHECKED_PER_FIGURE:]))
+    sample += [named[i] for i in picked]
+  with multiprocessing.get_context("spawn").Pool(1) as pool:
+    missing = [task for task, found in pool.map(stored_task, sample) if not found]
+  print("%d of %d figures found by a fresh process" % (len(sample) - len(missing), len(sample)))
+  for task in missing:
+    print("NOT STORED:", describe(task), file=sys.stderr)
+  return(missing)
+
+
+def describe(task):
+  name, args = task
+  return("%s%r" % (name, args))
+
+
+def warmup(tasks, workers):
+  done, failed, slow = 0, [], []
+  times = {}
+  start = time.perf_counter()
+  # Workers are started fresh, forked processes would share the parent's state
+  with multiprocessing.get_context("spawn").Pool(workers) as pool:
+    for task, seconds, error in pool.imap_unordered(run_task, tasks):
+      done += 1
+      times.setdefault(task[0], []).append(seconds)
+      if error:
+        failed.append((task, error))
+      if seconds >= SLOW_TASK_S:
+        slow.append((task, seconds))
+      if done % max(len(tasks) // 20, 1) == 0 or done == len(tasks):
+        print("[%d/%d] %.1f s" % (done, len(tasks), time.perf_counter() - start), flush=True)
+
+  print("\n%-25s %6s %10s %10s" % ("figure", "count", "total (s)", "max (s)"))
+  for name, seconds in times.items():
+    print("%-25s %6d %10.1f %10.2f" % (name, len(seconds), sum(seconds), max(seconds)))
+  for task, seconds in sorted(slow, key=lambda s: -s[1]):
+    print("slow: %s %.1f s" % (describe(task), seconds))
+  for task, error in failed:
+    print("FAILED:", describe(task), "\n" + error, file=sys.stderr)
+  print("%d figures in %.1f s with %d workers, %d failed" % (done, time.perf_counter() - start, workers, len(failed)))
+  return(failed)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Compute all the figures of the app into the figure store")
+  parser.add_argument("--workers", type=int, default=os.cpu_count())
+  parser.add_argument("--only", nargs="*", choices=["history", "maps", "changes", "static"], help="compute only these figures")
+  args = parser.parse_args()
+
+  import figurestore
+  if not figurestore.STORE_DIR:
+    sys.exit("The figure store is turned off (FIGURE_STORE_DIR is empty), there is nothing to warm up")
+  tasks = warmup_tasks(args.only) if args.only else warmup_tasks()
+  print("Computing", len(tasks), "figures into", figurestore.STORE_DIR, "with", args.workers, "workers")
+  failed = warmup(tasks, args.workers)
+  missing = check_stored([task for task in tasks if task not in [task for task, error in failed]])
+  sys.exit(1 if failed or missing else 0)
@@ -1,22 +1,20 @@
-from pandas.core.frame import DataFrame
 import streamlit as st
-from streamlit_folium import folium_static
-import pandas as pd
-import folium
-import plotly.express as px
-import time
-from sklearn.linear_model import LinearRegression
-from folium.plugins import Fullscreen
-import statsmodels.api as smapi
-import statsmodels as sm
-import plotly.graph_objs as go
+import os
 
-from util import load_data, get_OWID_data, max_year
-from plots import heatmap, changes_plot, emissions_history_plot, world_temperature, sector_breakdown
+import instrumentation
+from instrumentation import section
+# From the data API when DATA_API_URL is set, see client.py
+import client
+from sections import plotly_section, html_section
+from client import max_year, map_html, map_slider_html, changes_plot, emissions_history_plot, world_temperature, sector_breakdown
 
 
 
 
+# MAP_MODE=slider: the map has all the years and metrics and they are picked on the map, in the browser.
+# MAP_MODE=server: the year and metric are picked with streamlit widgets and the server sends a new map for every change
+MAP_MODE = os.environ.get("MAP_MODE", "slider")
+
 #######################################
 #     PAGE STRUCTURE AND CONTENT      #
 #######################################
@@ -24,12 +22,22 @@ from plots import heatmap, changes_plot, emissions_history_plot, world_temperatu
 
 # Setting page config
 st.set_page_config(page_title="Climate Change: A Nordic Perspective", page_icon="🌍", layout="wide")
+instrumentation.begin_rerun()
+# All the data files are read in the background at the first run, every section waits for the ones it uses
+client.start_loading()
+constants = client.page_constants()
+# Read once per run, the sections are recomputed when it changes
+data_version = client.data_version()
 
-df = get_OWID_data()
 # Create a header aligning the text to the center in streamlit
 # Create a sidebar with 3 pages
 st.sidebar.header("Menu")
-page = st.sidebar.radio("Pages", ("Home", "About"))
+pages = ("Home", "About")
+# Hidden page with the timings of the app, opened with ?diagnostics=1 in the address. The parameter needs a value, streamlit
+# drops query parameters without one. Run without a server (python world_map.py) there are no parameters and it returns ""
+if (st.experimental_get_query_params() or {}).get("diagnostics") == ["1"]:
+  pages += ("Diagnostics",)
+page = st.sidebar.radio("Pages", pages)
 
 
 # Write some text
@@ -68,7 +76,9 @@ cope with both the effects of climate change and the switch to clean energy.
 
   st.subheader("The temperature is rising")
   # Figure of worldwide mean temperature over time
-  st.plotly_chart(world_temperature())
+  with section("temperature plot"):
+    client.wait("temperature")
+    plotly_section(st.container(), "temperature plot", world_temperature, version=data_version)
   st.write("""
   Human-induced global warming reached about 1°C (likely between 0.8 and 1.2°C) above pre-industrial levels in 2017, with a 0.2°C increase per decade. 
   Most land regions are warming up faster than the global average - depending on the considered temperature dataset, 20-40% of the world population 
@@ -125,11 +135,12 @@ cope with both the effects of climate change and the switch to clean energy.
     st.write("")  # Just some padding
     st.write("")
     st.write("")
-    select_country = st.selectbox("Select region", ["World", "Europe", "Finland", "Sweden", "Norway", "China", "United States"])
+    select_country = st.selectbox("Select region", constants["history_regions"])
 
-  fig = emissions_history_plot(country = select_country, from_year = 1850)
-  with lineplot_space[0]:
-    st.plotly_chart(fig)
+  with section("emissions history plot"):
+    client.wait("owid", "forecasts")
+    plotly_section(lineplot_space[0], "emissions history plot", emissions_history_plot, select_country, constants["history_start_year"],
+                   version=data_version)
 
 
   st.write("""It's clear that CO2 emissions have been increasing for many years, 
@@ -142,38 +153,41 @@ cope with both the effects of climate change and the switch to clean energy.
 
 
 
-  # Load data
   # years in data set and in the slider
-  start_year = 1950
+  client.wait("owid")
+  start_year = constants["map_start_year"]
   end_year = int(max_year())
-  country_geo, df = load_data(start_year, end_year)
-
-  co2_per_capita_choropleth, co2_choropleth, co2_growth_choropleth = heatmap(country_geo, df.copy(), start_year, end_year)
-
-
-  # Setup a folium map at a high-level zoom
-  map = folium.Map(zoom_start=1, tiles='cartodbpositron')
-  # Set aside some space for the map
-  map_space = st.columns((2, 1))
-
-  with map_space[1]:
-    # slider for selecting the year
-    year_slider = st.slider("Year", start_year, end_year, end_year)
-    # radio buttons for selecting what to show
-    layer_radio = st.radio("Quantity", ('CO2 per capita', 'total CO2 emissions', 'CO2 growth percentage'))
-  if layer_radio == 'CO2 per capita':
-    co2_per_capita_choropleth[year_slider].add_to(map)
-  elif layer_radio == 'total CO2 emissions':
-    co2_choropleth[year_slider].add_to(map)
-  else:
-    co2_growth_choropleth[year_slider].add_to(map)
-
-  folium.LayerControl().add_to(map)
 
-  Fullscreen().add_to(map)
 
-  with map_space[0]:
-    folium_static(map, width = 900)
+  with section("map"):
+    # Set aside some space for the map
+    map_space = st.columns((2, 1))
+
+    if MAP_MODE == "slider":
+      with map_space[1]:
+        st.write("Pick the year with the slider and the quantity from the list at the bottom of the map.")
+      with map_space[0]:
+        client.wait("countries")
+        # The same html on every rerun, so the browser keeps the map and the year and quantity picked on it
+        html_section(map_space[0], "map", map_slider_html, "co2_per_capita", end_year, version=data_version, height = 510, width = 900)
+    else:
+      with map_space[1]:
+        # slider for selecting the year
+        year_slider = st.slider("Year", start_year, end_year, end_year)
+        # radio buttons for selecting what to show
+        layer_radio = st.radio("Quantity", ('CO2 per capita', 'total CO2 emissions', 'CO2 growth percentage'))
+      # total CO2 emissions and growth percentage are not shown by default, CO2 per capita is
+      if layer_radio == 'CO2 per capita':
+        metric = "co2_per_capita"
+      elif layer_radio == 'total CO2 emissions':
+        metric = "co2"
+      else:
+        metric = "co2_growth_prct"
+
+      with map_space[0]:
+        client.wait("countries")
+        # The same as streamlit_folium.folium_static, with the html of the map kept in plots.map_html
+        html_section(map_space[0], "map", map_html, metric, year_slider, version=data_version, height = 510, width = 900)
 
 
 
@@ -201,16 +215,10 @@ cope with both the effects of climate change and the switch to clean energy.
     slider_ph = st.empty()
     animate = st.button('animate')
 
-  year_scatter = slider_ph.slider("Year", start_year, end_year, end_year - 2, 1, key = 1)
-  fig = changes_plot(df, year_scatter, rangeX = None)
-  plot_ph.plotly_chart(fig)
-  
-  if animate:
-    for x in range(year_scatter, end_year, 1):
-      time.sleep(.5)
-      year_scatter = slider_ph.slider("Year", start_year, end_year, year_scatter + 1, 1, key = str(year_scatter) + "animation")
-      fig = changes_plot(df, year_scatter, rangeX = [-100, 100])
-      plot_ph.plotly_chart(fig)
+  with section("changes plot"):
+    year_scatter = slider_ph.slider("Year", start_year, end_year, end_year - 2, 1, key = 1)
+    # With animate all the years from the selected one on are sent at once and played in the browser
+    plotly_section(plot_ph, "changes plot", changes_plot, year_scatter, animate, version=data_version)
 
 
 
@@ -226,7 +234,9 @@ cope with both the effects of climate change and the switch to clean energy.
 
   # Solutions, not just sources
   st.subheader("But, which sectors actually contribute to this?")
-  st.write(sector_breakdown())
+  with section("sector breakdown"):
+    client.wait("sectors")
+    plotly_section(st.container(), "sector breakdown", sector_breakdown, version=data_version)
   st.write("""
   Global emissions can be grouped according to their source sectors. One way to do this is the following where 4 different sources are 
   identified and those then broken into further sub-sectors and sub-sub-sectors. These four sectors are from the largest to the smallest: 
@@ -279,6 +289,41 @@ cope with both the effects of climate change and the switch to clean energy.
 
   
 
+elif page == "Diagnostics":
+  st.title("Diagnostics")
+  import datacache
+  values, memory = datacache.cache_size()
+  st.write("Data cache: %d values, %.1f MB of %.0f MB, dataset version %s" % (values, memory, datacache.MAX_MB, datacache.dataset_version()))
+  # The growth of the resident memory since the first complete run, less the growth of the shared cached data, is taken by the
+  # sessions that connected after it
+  sessions = instrumentation.session_count() or 1
+  resident = instrumentation.rss_mb()
+  baseline = instrumentation.BASELINE
+  if not baseline:
+    st.write("Resident memory %.0f MB. The memory of the sessions is measured from the end of the first run, rerun the page" % resident)
+  else:
+    st.write("Resident memory %.0f MB, %.0f MB of it after the first complete run (the libraries, the data it loaded and %d session%s)" %
+             (resident, baseline["resident_mb"], baseline["sessions"], "" if baseline["sessions"] == 1 else "s"))
+    if sessions > baseline["sessions"]:
+      added = sessions - baseline["sessions"]
+      st.write("Since then the shared data grew by %.1f MB and each of the %d sessions added after it took about %.1f MB" %
+               (memory - baseline["shared_mb"], added, max(resident - baseline["resident_mb"] - (memory - baseline["shared_mb"]), 0) / added))
+    else:
+      st.write("No session has connected since the first run, the memory a session takes is shown once more of them are open")
+  st.dataframe(datacache.memory_report())
+  if not client.API_URL:
+    import assets
+    st.write("Data files loaded in the background (seconds):")
+    st.dataframe(assets.load_table())
+  else:
+    st.write("The data and figures come from the data API at " + client.API_URL)
+  if not instrumentation.ENABLED:
+    st.write("Nothing is recorded, start the app with APP_METRICS=1 to record the timings.")
+  else:
+    st.write("Timings since the app was started. They are also written to " + instrumentation.METRICS_FILE + " after every rerun.")
+    st.dataframe(instrumentation.metrics_table())
+    st.text(instrumentation.metrics_text())
+
 elif page == "About":
   st.title("About")
   st.write("""
@@ -321,6 +366,9 @@ elif page == "About":
 
 
 
+instrumentation.end_rerun()
+
+
 #################################################
 #  CODE EXAMPLES
 ################